@@ -1,15 +1,28 @@
 import os
 from typing import Dict, Any
 import logging
-from services.real_ai_service import RealAIService
-from services.real_web_search import RealWebSearchService  
 
 logger = logging.getLogger(__name__)
 
 class LLMEngine:
     def __init__(self):
-        self.ai_service = RealAIService()
-        self.web_search = RealWebSearchService()  
+        # SDK clients are created on first use so importing the engine stays cheap
+        self._ai_service = None
+        self._web_search = None
+    
+    @property
+    def ai_service(self):
+        if self._ai_service is None:
+            from services.real_ai_service import RealAIService
+            self._ai_service = RealAIService()
+        return self._ai_service
+    
+    @property
+    def web_search(self):
+        if self._web_search is None:
+            from services.real_web_search import RealWebSearchService
+            self._web_search = RealWebSearchService()
+        return self._web_search
     
     async def process(self, query: str, context: str = None, use_web_search: bool = False) -> Dict[str, Any]:
         """
@@ -1,26 +1,56 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, JSON
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, DateTime, JSON, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 import os
-from dotenv import load_dotenv
-
-load_dotenv('../.env')
 
 Base = declarative_base()
 
 class WorkflowDB(Base):
     __tablename__ = "workflows"
-    
+
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), nullable=False)
-    components = Column(JSON)
+    # Snapshot of version 1; later versions live in workflow_versions
+    components = Column(JSON, nullable=False)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class WorkflowVersionDB(Base):
+    __tablename__ = "workflow_versions"
+
+    id = Column(Integer, primary_key=True)
+    workflow_id = Column(Integer, ForeignKey("workflows.id", ondelete="CASCADE"), nullable=False)
+    version = Column(Integer, nullable=False)
+    # "patch" = JSON Patch against the previous version, "snapshot" = full graph
+    kind = Column(String(8), nullable=False)
+    data = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_workflow_versions_workflow_version", "workflow_id", "version", unique=True),
+    )
 
 def get_engine():
-    database_url = os.getenv('DATABASE_URL', 'sqlite:///./flowintellect.db')
-    return create_engine(database_url)
+    return create_engine(os.getenv('DATABASE_URL', 'sqlite:///./flowintellect.db'),
+                        connect_args={"check_same_thread": False})
+
+def _add_missing_columns(engine):
+    """Bring databases created before workflow versioning up to date"""
+    existing = {column['name'] for column in inspect(engine).get_columns("workflows")}
+    with engine.begin() as conn:
+        for column in WorkflowDB.__table__.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE workflows ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+            if column.name == "version":
+                ddl += " NOT NULL DEFAULT 1"
+            conn.execute(text(ddl))
+            print(f"🔧 Added column workflows.{column.name}")
 
 def create_tables():
     engine = get_engine()
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    _add_missing_columns(engine)
+    print("✅ Database ready")
+    return engine
@@ -1,50 +1,48 @@
+import time
+_import_started = time.perf_counter()
+
 import os
 import uuid
+import asyncio
+import functools
+import hmac
 import logging
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import shutil
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from dotenv import load_dotenv
-from typing import Optional, Dict, Any, List
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, JSON
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.sql import func
-import requests
+from typing import TYPE_CHECKING, Annotated, Optional, Dict, Any, List
 import json
+from contextlib import asynccontextmanager
+
+from app.services.admission import AdmissionController, AdmissionRejected
+from app.services.providers import make_llm_backend, make_search_backend
+from app.services.intent import classify_query, tokenize
+from app.services.flight_recorder import FlightRecorder, FlightRecorderMiddleware, item, stage, annotate
+
+if TYPE_CHECKING:
+    # SQLAlchemy costs ~200 ms to import; it is loaded with the database on first use
+    from sqlalchemy.orm import Session
+    from app.database_models import WorkflowDB
 
 load_dotenv('.env')
 
 UPLOAD_DIRECTORY = "uploaded_documents"
 os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
 
-# Database
-Base = declarative_base()
-
-class WorkflowDB(Base):
-    __tablename__ = "workflows"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String(100), nullable=False)
-    components = Column(JSON, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-
-# Database setup
-def get_engine():
-    return create_engine(os.getenv('DATABASE_URL', 'sqlite:///./flowintellect.db'), 
-                        connect_args={"check_same_thread": False})
-
-def create_tables():
-    engine = get_engine()
-    Base.metadata.create_all(bind=engine)
-    print("✅ Database ready")
-    return engine
-
-engine = create_tables()
-SessionLocal = sessionmaker(bind=engine)
+# Database setup (models live in database_models.py)
+# SQLAlchemy is imported and bound to the engine on first use (or at startup), not at import time
+@functools.lru_cache(maxsize=None)
+def init_database():
+    from sqlalchemy.orm import sessionmaker
+    from app.database_models import create_tables
+    return sessionmaker(bind=create_tables())
 
 def get_db():
-    db = SessionLocal()
+    db = init_database()()
     try:
         yield db
     finally:
@@ -68,13 +66,35 @@ class KnowledgeBase:
                 content = ''.join([page.get_text() for page in doc])
                 doc.close()
             
-            self.documents[doc_id] = {'content': content, 'filename': filename}
+            self.documents[doc_id] = {'content': content, 'content_lower': content.lower(), 'filename': filename}
             print(f"✅ Added: {filename} ({len(content)} chars)")
             return True
         except Exception as e:
             print(f"❌ Document error: {e}")
             return False
     
+    def _match(self, doc_id: str, doc_data: dict, query_lower: str) -> Optional[dict]:
+        content = doc_data['content']
+        index = doc_data['content_lower'].find(query_lower)
+        if index == -1:
+            return None
+        
+        start = max(0, index - 50)
+        end = min(len(content), index + len(query_lower) + 100)
+        context = content[start:end]
+        
+        if start > 0:
+            context = "..." + context
+        if end < len(content):
+            context = context + "..."
+        
+        return {
+            'filename': doc_data['filename'],
+            'context': context,
+            'score': 1.0,
+            'doc_id': doc_id
+        }
+    
     def search(self, query: str, max_results: int = 3) -> list:
         if not self.documents:
             print("📚 No documents in knowledge base")
@@ -86,41 +106,42 @@ class KnowledgeBase:
         print(f"🔍 Searching for '{query}' in {len(self.documents)} documents")
         
         for doc_id, doc_data in self.documents.items():
-            content = doc_data['content']
-            filename = doc_data['filename']
-            
-            if query_lower in content.lower():
-                
-                content_lower = content.lower()
-                index = content_lower.find(query_lower)
-                
-                if index != -1:
-                    start = max(0, index - 50)
-                    end = min(len(content), index + len(query_lower) + 100)
-                    context = content[start:end]
-                    
-                    if start > 0:
-                        context = "..." + context
-                    if end < len(content):
-                        context = context + "..."
-                    
-                    results.append({
-                        'filename': filename,
-                        'context': context,
-                        'score': 1.0,
-                        'doc_id': doc_id
-                    })
-                    print(f"📚 ✅ Found match in: {filename}")
+            match = self._match(doc_id, doc_data, query_lower)
+            if match:
+                results.append(match)
+                print(f"📚 ✅ Found match in: {doc_data['filename']}")
         
         print(f"📚 Search completed: {len(results)} results found")
         return results[:max_results]
+    
+    def search_many(self, queries: List[str], max_results: int = 3) -> Dict[str, list]:
+        """Search several queries in one pass over the documents (used by batch chat)"""
+        unique = {query.lower().strip() for query in queries}
+        hits = {query_lower: [] for query_lower in unique}
+        
+        for doc_id, doc_data in self.documents.items():
+            for query_lower in unique:
+                if len(hits[query_lower]) >= max_results:
+                    continue
+                match = self._match(doc_id, doc_data, query_lower)
+                if match:
+                    hits[query_lower].append(match)
+        
+        print(f"📚 Batch search: {len(unique)} unique queries over {len(self.documents)} documents")
+        return {query: hits[query.lower().strip()] for query in queries}
 
-knowledge_base = KnowledgeBase()
+@functools.lru_cache(maxsize=None)
+def get_knowledge_base() -> KnowledgeBase:
+    return KnowledgeBase()
 
 class AIService:
     def __init__(self):
         self.gemini_key = os.getenv('GEMINI_API_KEY')
-        if self.gemini_key:
+        self.backend = make_llm_backend(self.gemini_key)
+        if self.backend.name == "simulator":
+            self.gemini_key = self.gemini_key or "simulator"
+            print("🧪 Simulated Gemini AI Service ready")
+        elif self.gemini_key:
             print("✅ Gemini AI Service ready")
         else:
             print("❌ Gemini API key not found")
@@ -138,10 +159,15 @@ class AIService:
                 "gemini-flash-latest",        
             ]
             
-            for model_name in working_models:
+            throttled = 0
+            for attempt, model_name in enumerate(working_models, 1):
+                # admit() counted the first request; every fallback model is another one
+                if attempt > 1 and not get_admission().charge(self.gemini_key):
+                    print("🚦 Daily Gemini quota spent, not trying more models")
+                    return "❌ Gemini daily quota reached. Please try again tomorrow."
+                annotate(model_attempts=attempt)
                 try:
                     print(f"🔄 Trying Gemini model: {model_name}")
-                    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={self.gemini_key}"
                     
                     data = {
                         "contents": [{"parts": [{"text": prompt}]}],
@@ -153,22 +179,30 @@ class AIService:
                         }
                     }
                     
-                    response = requests.post(url, json=data, timeout=30)
+                    with stage(f"llm:{model_name}"):
+                        status_code, result = self.backend.generate(model_name, data, timeout=30)
                     
-                    if response.status_code == 200:
-                        result = response.json()
+                    if status_code == 200:
                         if 'candidates' in result and result['candidates']:
                             text = result['candidates'][0]['content']['parts'][0]['text']
                             print(f"✅ Gemini success with {model_name}")
+                            annotate(model=model_name)
                             return text
                     else:
-                        print(f"❌ Gemini {model_name} failed: {response.status_code}")
+                        print(f"❌ Gemini {model_name} failed: {status_code}")
+                        if status_code == 429:
+                            throttled += 1
                         continue
                         
                 except Exception as e:
                     print(f"❌ Gemini {model_name} error: {e}")
                     continue
             
+            if throttled == len(working_models):
+                # Every model is rate limited - stop admitting calls for a while
+                get_admission().cool_down(self.gemini_key, float(os.getenv('LLM_THROTTLE_COOLDOWN', '60')))
+                return "❌ Gemini rate limit reached. Please try again in a minute."
+            
             return "❌ All Gemini models failed. Please check your API key configuration."
             
         except Exception as e:
@@ -178,8 +212,11 @@ class AIService:
 class WebSearchService:
     def __init__(self):
         self.api_key = os.getenv('SERPAPI_KEY')
-        self.available = bool(self.api_key)
-        if self.available:
+        self.backend = make_search_backend(self.api_key)
+        self.available = bool(self.api_key) or self.backend.name == "simulator"
+        if self.backend.name == "simulator":
+            print("🧪 Simulated Web Search ready")
+        elif self.available:
             print("✅ SerpAPI Web Search ready")
         else:
             print("❌ SerpAPI key not found")
@@ -188,10 +225,10 @@ class WebSearchService:
         if not self.available:
             return ""
         
-        # DON'T use web search for simple greetings
-        simple_queries = ['hello', 'hi', 'hey', 'how are you', 'what is your name', 'good morning', 'good afternoon']
-        if any(simple in query.lower() for simple in simple_queries):
-            print("🌐 Skipping web search for simple query")
+        # DON'T use web search for greetings or arithmetic
+        intent = classify_query(query)
+        if intent.route == "direct":
+            print(f"🌐 Skipping web search ({intent.route} query)")
             return ""
         
         try:
@@ -199,43 +236,37 @@ class WebSearchService:
             
             params = {
                 'q': query,
-                'api_key': self.api_key,
                 'engine': 'google',
                 'num': 3
             }
             
-            response = requests.get('https://serpapi.com/search', params=params, timeout=30)
+            status_code, results = await run_in_threadpool(self.backend.search, params, timeout=30)
             
-            if response.status_code == 200:
-                results = response.json()
-                web_context = self._parse_serp_results(results, query)
+            if status_code == 200:
+                web_context = self._parse_serp_results(results, intent.keywords)
                 result_count = len(web_context.splitlines())
                 print(f"✅ Web search found {result_count} relevant results")
+                annotate(web_results=result_count)
                 return web_context
             else:
-                print(f"❌ SerpAPI error: {response.status_code}")
+                print(f"❌ SerpAPI error: {status_code}")
                 return ""
                 
         except Exception as e:
             print(f"❌ Web search error: {e}")
             return ""
     
-    def _parse_serp_results(self, results: dict, original_query: str) -> str:
+    def _parse_serp_results(self, results: dict, query_keywords: frozenset) -> str:
         """Parse SerpAPI results into readable text with relevance filtering"""
         context_parts = []
         
-        irrelevant_queries = ['hello', 'hi', 'hey', 'how are you']
-        if any(query in original_query.lower() for query in irrelevant_queries):
-            return ""
-        
         if 'organic_results' in results:
             for i, result in enumerate(results['organic_results'][:3]):
                 title = result.get('title', '')
                 snippet = result.get('snippet', '')
                 if title and snippet:
-                  
-                    if any(keyword in title.lower() or keyword in snippet.lower() 
-                           for keyword in original_query.lower().split()):
+                    
+                    if not query_keywords.isdisjoint(tokenize(f"{title} {snippet}")):
                         context_parts.append(f"{i+1}. {title}: {snippet}")
         
         
@@ -247,11 +278,67 @@ class WebSearchService:
         return "\n".join(context_parts) if context_parts else ""
 
 
-ai_service = AIService()
-web_search = WebSearchService()
+@functools.lru_cache(maxsize=None)
+def get_ai_service() -> AIService:
+    return AIService()
+
+@functools.lru_cache(maxsize=None)
+def get_web_search() -> WebSearchService:
+    return WebSearchService()
+
+@functools.lru_cache(maxsize=None)
+def get_admission() -> AdmissionController:
+    # Admission control for upstream LLM calls (Gemini free tier: 50 requests/day)
+    return AdmissionController(
+        key_rate_per_minute=float(os.getenv('LLM_RATE_PER_MINUTE', '10')),
+        key_burst=int(os.getenv('LLM_BURST', '5')),
+        workflow_rate_per_minute=float(os.getenv('LLM_WORKFLOW_RATE_PER_MINUTE', '6')),
+        workflow_burst=int(os.getenv('LLM_WORKFLOW_BURST', '3')),
+        daily_quota=int(os.getenv('GEMINI_DAILY_QUOTA', '50')),
+        max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', '4')),
+        max_queue=int(os.getenv('LLM_MAX_QUEUE', '16')),
+        max_wait=float(os.getenv('LLM_MAX_WAIT', '10')),
+    )
+
+# Slow-request flight recorder (opt-in, see app/services/flight_recorder.py)
+FLIGHT_RECORDER_ENABLED = os.getenv('FLIGHT_RECORDER', '0') == '1'
+
+@functools.lru_cache(maxsize=None)
+def get_flight_recorder() -> FlightRecorder:
+    return FlightRecorder(
+        enabled=FLIGHT_RECORDER_ENABLED,
+        capacity=int(os.getenv('FLIGHT_RECORDER_SIZE', '100')),
+        slow_ms=float(os.getenv('SLOW_REQUEST_MS', '2000')),
+        profile_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+        profile_interval_ms=float(os.getenv('PROFILE_INTERVAL_MS', '5')),
+    )
+
+def is_admin_token(token: Optional[str]) -> bool:
+    """True only when ADMIN_TOKEN is set and `token` matches it"""
+    admin_token = os.getenv('ADMIN_TOKEN')
+    return bool(admin_token and token) and hmac.compare_digest(token.encode(), admin_token.encode())
 
 # FastAPI App
-app = FastAPI(title="FlowIntellect API - Gemini + SerpAPI")
+STARTUP_BUDGET_MS = float(os.getenv('STARTUP_BUDGET_MS', '1500'))
+startup_ms = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the database and services once the server starts, not on import"""
+    global startup_ms
+    init_database()
+    get_knowledge_base()
+    get_ai_service()
+    get_web_search()
+    get_admission()
+    startup_ms = round((time.perf_counter() - _import_started) * 1000, 1)
+    if startup_ms > STARTUP_BUDGET_MS:
+        print(f"⚠️ Cold start took {startup_ms} ms (budget {STARTUP_BUDGET_MS:.0f} ms)")
+    else:
+        print(f"🚀 Cold start in {startup_ms} ms (budget {STARTUP_BUDGET_MS:.0f} ms)")
+    yield
+
+app = FastAPI(title="FlowIntellect API - Gemini + SerpAPI", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -260,10 +347,100 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if FLIGHT_RECORDER_ENABLED:
+    # Only installed when enabled, so a disabled recorder adds no middleware hop
+    # X-Profile is only honoured together with a valid X-Admin-Token
+    app.add_middleware(FlightRecorderMiddleware, get_recorder=get_flight_recorder, authorize_profile=is_admin_token)
+
 # Pydantic models
+# Longer messages are rejected with 422 before any routing or prompt building
+MAX_MESSAGE_CHARS = int(os.getenv('MAX_MESSAGE_CHARS', '8000'))
+MessageText = Annotated[str, Field(max_length=MAX_MESSAGE_CHARS)]
+
 class ChatMessage(BaseModel):
-    message: str
+    message: MessageText
     workflow_id: Optional[str] = "default"
+    priority: Optional[int] = 0
+
+class BatchChatRequest(BaseModel):
+    workflow_id: str
+    messages: List[MessageText]
+    concurrency: int = 4
+    priority: int = 10
+
+BATCH_MAX_MESSAGES = int(os.getenv('BATCH_MAX_MESSAGES', '500'))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '8'))
+# Batch items are paced rather than rejected: they may wait this long for capacity
+BATCH_MAX_WAIT = float(os.getenv('BATCH_MAX_WAIT', '600'))
+# A full admission queue drains as soon as any call finishes, so retry it quickly
+BATCH_QUEUE_BACKOFF = float(os.getenv('BATCH_QUEUE_BACKOFF', '1'))
+
+# Lower values are served first; batches can never jump ahead of interactive chat
+PRIORITY_MAX = 100
+BATCH_MIN_PRIORITY = 10
+
+def clamp_priority(priority: Optional[int], minimum: int = 0) -> int:
+    return max(minimum, min(priority or 0, PRIORITY_MAX))
+
+# Workflow helpers
+def compile_workflow(workflow: "WorkflowDB", components: Any) -> Dict[str, Any]:
+    """Extract the chat settings from a saved React Flow graph"""
+    web_search_enabled = False
+    knowledge_base_enabled = False
+    
+    # Handle both list and dict formats
+    if isinstance(components, dict):
+        components = list(components.values())
+    if isinstance(components, list):
+        for component in components:
+            if isinstance(component, dict):
+                if component.get('type') == 'llmEngine':
+                    web_search_enabled = component.get('data', {}).get('webSearch', False)
+                elif component.get('type') == 'knowledgeBase':
+                    knowledge_base_enabled = component.get('data', {}).get('useContext', False)
+    
+    return {"name": workflow.name, "web_search": web_search_enabled, "knowledge_base": knowledge_base_enabled}
+
+def wants_web_search(intent, settings: Dict[str, Any], kb_results: list) -> bool:
+    """Search the web for web queries, and for kb queries the knowledge base can't answer"""
+    if not settings['web_search'] or intent.route == "direct":
+        return False
+    return intent.use_web or not (settings['knowledge_base'] and kb_results)
+
+def build_prompt(query: str, settings: Dict[str, Any], web_context: str, kb_results: list):
+    """Assemble the LLM prompt; returns (prompt, kb_context)"""
+    kb_context = ""
+    if kb_results:
+        kb_context = "\n".join([f"📄 {r['filename']}: {r['context']}" for r in kb_results])
+        print(f"📚 Found {len(kb_results)} knowledge base results")
+        
+        if settings['knowledge_base'] or not settings['web_search']:
+            print(f"📚 Using knowledge base results")
+        else:
+            print("📚 Knowledge base results available but not used (both KB and web search disabled)")
+            kb_context = ""
+    else:
+        print("📚 No knowledge base results found")
+    
+    prompt_parts = []
+    
+    if web_context:
+        prompt_parts.append(f"🌐 WEB SEARCH RESULTS:\n{web_context}")
+    
+    if kb_context:
+        prompt_parts.append(f"📚 KNOWLEDGE BASE DOCUMENTS:\n{kb_context}")
+    
+    if prompt_parts:
+        context_section = "\n\n".join(prompt_parts)
+        prompt = f"""{context_section}
+
+👤 USER QUESTION: {query}
+
+🤖 Please provide a helpful response using the available information above:"""
+    else:
+        prompt = f"User: {query}\n\nPlease provide a helpful and natural response."
+    
+    return prompt, kb_context
 
 # Routes
 @app.get("/")
@@ -274,67 +451,160 @@ async def root():
 async def health():
     return {
         "status": "healthy", 
-        "gemini_ready": bool(ai_service.gemini_key),
-        "web_search_ready": web_search.available,
-        "knowledge_base_docs": len(knowledge_base.documents)
+        "gemini_ready": bool(get_ai_service().gemini_key),
+        "web_search_ready": get_web_search().available,
+        "llm_provider": get_ai_service().backend.name,
+        "search_provider": get_web_search().backend.name,
+        "knowledge_base_docs": len(get_knowledge_base().documents),
+        "startup_ms": startup_ms
+    }
+
+@app.get("/api/quota")
+async def get_quota():
+    """Live quota accounting and admission queue state for LLM calls"""
+    return get_admission().stats(get_ai_service().gemini_key)
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Admin endpoints expose prompts and stacks; they stay closed until ADMIN_TOKEN is set"""
+    if not os.getenv('ADMIN_TOKEN'):
+        raise HTTPException(403, "Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(403, "Admin token required")
+
+@app.get("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def get_slow_requests(limit: int = 20):
+    """Most recent slow requests with stage timings, newest first, plus profiled fast requests"""
+    recorder = get_flight_recorder()
+    return {
+        "enabled": recorder.enabled,
+        "slow_ms": recorder.slow_ms,
+        "profile_rate": recorder.profile_rate,
+        "requests_seen": recorder.seen,
+        "requests": recorder.slow_requests(limit),
+        "profiles": recorder.profiled_requests(limit)
+    }
+
+@app.get("/admin/slow-requests/{request_id}", dependencies=[Depends(require_admin)])
+async def get_slow_request(request_id: int):
+    record = get_flight_recorder().get(request_id)
+    if record is None:
+        raise HTTPException(404, "Request not in flight recorder")
+    return record
+
+@app.delete("/admin/slow-requests", dependencies=[Depends(require_admin)])
+async def clear_slow_requests():
+    get_flight_recorder().clear()
+    return {"status": "success", "message": "Flight recorder cleared"}
+
+def _workflow_summary(wf) -> Dict[str, Any]:
+    return {
+        "id": wf.id,
+        "name": wf.name,
+        "version": wf.version or 1,
+        "created_at": wf.created_at.isoformat() if wf.created_at else None,
+        "updated_at": wf.updated_at.isoformat() if wf.updated_at else None
     }
 
+def _get_workflow_or_404(db: "Session", workflow_id: Any) -> "WorkflowDB":
+    from app.database_models import WorkflowDB
+    try:
+        workflow_id = int(workflow_id)
+    except (TypeError, ValueError):
+        raise HTTPException(404, "Workflow not found")
+    workflow = db.query(WorkflowDB).filter(WorkflowDB.id == workflow_id).first()
+    if not workflow:
+        raise HTTPException(404, "Workflow not found")
+    return workflow
+
 @app.get("/workflows")
-async def get_workflows(db: Session = Depends(get_db)):
+async def get_workflows(db: "Session" = Depends(get_db)):
+    """List workflows without loading their graphs (use GET /workflows/{id} for components)"""
+    from app.database_models import WorkflowDB
     try:
-        workflows = db.query(WorkflowDB).order_by(WorkflowDB.created_at.desc()).all()
-        return {
-            "workflows": [
-                {
-                    "id": wf.id,
-                    "name": wf.name, 
-                    "components": wf.components,
-                    "created_at": wf.created_at.isoformat()
-                }
-                for wf in workflows
-            ]
-        }
+        workflows = (
+            db.query(WorkflowDB.id, WorkflowDB.name, WorkflowDB.version, WorkflowDB.created_at, WorkflowDB.updated_at)
+            .order_by(WorkflowDB.created_at.desc())
+            .all()
+        )
+        return {"workflows": [_workflow_summary(wf) for wf in workflows]}
     except Exception as e:
         print(f"❌ Get workflows error: {e}")
         return {"workflows": []}
 
+@app.get("/workflows/{workflow_id}")
+async def get_workflow(workflow_id: int, version: Optional[int] = None, db: "Session" = Depends(get_db)):
+    from app.services import workflow_versions
+    workflow = _get_workflow_or_404(db, workflow_id)
+    try:
+        components = workflow_versions.load_components(db, workflow, version)
+    except ValueError as e:
+        raise HTTPException(404, str(e))
+    return {**_workflow_summary(workflow), "version": version or workflow.version, "latest_version": workflow.version, "components": components}
+
+@app.get("/workflows/{workflow_id}/versions")
+async def get_workflow_versions(workflow_id: int, db: "Session" = Depends(get_db)):
+    from app.services import workflow_versions
+    workflow = _get_workflow_or_404(db, workflow_id)
+    return {"workflow_id": workflow.id, "versions": workflow_versions.list_versions(db, workflow)}
+
 @app.post("/workflows")
-async def save_workflow(workflow_data: Dict[str, Any], db: Session = Depends(get_db)):
+async def save_workflow(workflow_data: Dict[str, Any], db: "Session" = Depends(get_db)):
+    from app.services import workflow_versions
     try:
         print(f"💾 Saving workflow: {workflow_data.get('name')}")
         
-        workflow = WorkflowDB(
+        workflow = workflow_versions.create_workflow(
+            db,
             name=workflow_data.get("name", "Unnamed"),
             components=workflow_data.get("components", {})
         )
-        db.add(workflow)
-        db.commit()
-        db.refresh(workflow)
         
         print(f"✅ Workflow saved with ID: {workflow.id}")
-        return {"status": "success", "workflow_id": workflow.id, "message": "Workflow saved!"}
+        return {"status": "success", "workflow_id": workflow.id, "version": workflow.version, "message": "Workflow saved!"}
     except Exception as e:
         db.rollback()
         print(f"❌ Save workflow error: {e}")
         raise HTTPException(500, f"Save failed: {str(e)}")
 
+@app.put("/workflows/{workflow_id}")
+async def update_workflow(workflow_id: int, workflow_data: Dict[str, Any], db: "Session" = Depends(get_db)):
+    """Save a new version of an existing workflow; only the diff is stored"""
+    from sqlalchemy.exc import IntegrityError
+    from app.services import workflow_versions
+    workflow = _get_workflow_or_404(db, workflow_id)
+    try:
+        changed = workflow_versions.save_version(
+            db, workflow,
+            components=workflow_data.get("components"),
+            name=workflow_data.get("name")
+        )
+        print(f"✅ Workflow {workflow.id} {'saved as' if changed else 'unchanged at'} version {workflow.version}")
+        return {"status": "success", "workflow_id": workflow.id, "version": workflow.version, "changed": changed, "message": "Workflow saved!"}
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(409, "Workflow was modified concurrently, reload and try again")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Update workflow error: {e}")
+        raise HTTPException(500, f"Save failed: {str(e)}")
+
 @app.delete("/workflows/{workflow_id}")
-async def delete_workflow(workflow_id: int, db: Session = Depends(get_db)):
+async def delete_workflow(workflow_id: int, db: "Session" = Depends(get_db)):
+    from app.services import workflow_versions
     try:
-        workflow = db.query(WorkflowDB).filter(WorkflowDB.id == workflow_id).first()
-        if not workflow:
-            raise HTTPException(404, "Workflow not found")
-        
-        db.delete(workflow)
-        db.commit()
+        workflow = _get_workflow_or_404(db, workflow_id)
+        workflow_versions.delete_workflow(db, workflow)
         print(f"✅ Workflow {workflow_id} deleted")
         return {"status": "success", "message": "Workflow deleted"}
+    except HTTPException:
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(500, f"Delete failed: {str(e)}")
 
 @app.post("/chat")
-async def chat(message: ChatMessage, db: Session = Depends(get_db)):
+async def chat(message: ChatMessage, db: "Session" = Depends(get_db)):
+    from app.services import workflow_versions
     try:
         print(f"💬 Chat request: '{message.message}' (Workflow: {message.workflow_id})")
         
@@ -345,87 +615,156 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
                 "workflow_required": True
             }
       
-        web_search_enabled = False
-        knowledge_base_enabled = False
-        workflow_name = "Unknown"
-        
-        if message.workflow_id:
-            workflow = db.query(WorkflowDB).filter(WorkflowDB.id == int(message.workflow_id)).first()
-            if workflow:
-                workflow_name = workflow.name
-                components = workflow.components
-                
-                # Handle both list and dict formats
-                if isinstance(components, dict):
-                    for comp_id, comp_data in components.items():
-                        if isinstance(comp_data, dict):
-                            if comp_data.get('type') == 'llmEngine':
-                                web_search_enabled = comp_data.get('data', {}).get('webSearch', False)
-                            elif comp_data.get('type') == 'knowledgeBase':
-                                knowledge_base_enabled = comp_data.get('data', {}).get('useContext', False)
-                elif isinstance(components, list):
-                    for component in components:
-                        if isinstance(component, dict):
-                            if component.get('type') == 'llmEngine':
-                                web_search_enabled = component.get('data', {}).get('webSearch', False)
-                            elif component.get('type') == 'knowledgeBase':
-                                knowledge_base_enabled = component.get('data', {}).get('useContext', False)
-        
-        print(f"🔧 Workflow: {workflow_name}, Web Search: {web_search_enabled}, KB: {knowledge_base_enabled}")
-        
-        
-        web_context = ""
-        if web_search_enabled:
-            web_context = await web_search.search(message.message)
-        
-        
-        kb_context = ""
-        kb_results = knowledge_base.search(message.message)
-        
-        if kb_results:
-            kb_context = "\n".join([f"📄 {r['filename']}: {r['context']}" for r in kb_results])
-            print(f"📚 Found {len(kb_results)} knowledge base results")
-            
+        # Unknown workflows are refused before admission, so rate limits are keyed by real ids only
+        with stage("workflow"):
+            workflow = _get_workflow_or_404(db, message.workflow_id)
+            settings = compile_workflow(workflow, workflow_versions.load_components(db, workflow))
+        
+        intent = classify_query(message.message)
+        print(f"🔧 Workflow: {settings['name']}, Web Search: {settings['web_search']}, KB: {settings['knowledge_base']}, Route: {intent.route}")
+        annotate(workflow_id=message.workflow_id, route=intent.route, query_chars=len(message.message))
+        
+        # Admit the call before spending web search or LLM quota
+        with stage("admission"):
+            ticket = await get_admission().admit(get_ai_service().gemini_key, workflow.id, clamp_priority(message.priority))
+        async with ticket:
+            kb_results = []
+            if intent.use_kb:
+                with stage("kb_search"):
+                    kb_results = get_knowledge_base().search(message.message)
+                annotate(kb_docs_scanned=len(get_knowledge_base().documents), kb_results=len(kb_results))
             
-            if knowledge_base_enabled or (not web_search_enabled and kb_results):
-                print(f"📚 Using knowledge base results")
-            else:
-                print("📚 Knowledge base results available but not used (both KB and web search disabled)")
-                kb_context = ""
-        else:
-            print("📚 No knowledge base results found")
-        
-        prompt_parts = []
-        
-        if web_context:
-            prompt_parts.append(f"🌐 WEB SEARCH RESULTS:\n{web_context}")
-        
-        if kb_context:
-            prompt_parts.append(f"📚 KNOWLEDGE BASE DOCUMENTS:\n{kb_context}")
-        
-        if prompt_parts:
-            context_section = "\n\n".join(prompt_parts)
-            prompt = f"""{context_section}
-
-👤 USER QUESTION: {message.message}
-
-🤖 Please provide a helpful response using the available information above:"""
-        else:
+            web_context = ""
+            if wants_web_search(intent, settings, kb_results):
+                with stage("web_search"):
+                    web_context = await get_web_search().search(message.message)
             
-            prompt = f"User: {message.message}\n\nPlease provide a helpful and natural response."
-        
-        response_text = ai_service.generate_response(prompt)
+            prompt, kb_context = build_prompt(message.message, settings, web_context, kb_results)
+            annotate(prompt_chars=len(prompt), web_context_chars=len(web_context), kb_context_chars=len(kb_context))
+            with stage("llm"):
+                response_text = await run_in_threadpool(get_ai_service().generate_response, prompt)
         
         return {
             "response": response_text,
-            "workflow_used": workflow_name,
-            "web_search_used": web_search_enabled and bool(web_context),
+            "workflow_used": settings['name'],
+            "web_search_used": settings['web_search'] and bool(web_context),
             "kb_used": bool(kb_context)
         }
         
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise HTTPException(
+            503,
+            f"LLM capacity exhausted ({e.reason}). Please retry in {e.retry_after}s.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
     except Exception as e:
         print(f"❌ Chat error: {str(e)}")
         return {"response": f"❌ System error: {str(e)}", "error": True}
+
+@app.post("/chat/batch")
+async def chat_batch(batch: BatchChatRequest, db: "Session" = Depends(get_db)):
+    """
+    Run many messages through one saved workflow.
+    Results are streamed back as NDJSON, one line per message as it finishes,
+    followed by a summary line.
+    """
+    from app.services import workflow_versions
+    if not batch.messages:
+        raise HTTPException(400, "No messages provided")
+    if len(batch.messages) > BATCH_MAX_MESSAGES:
+        raise HTTPException(400, f"Too many messages (max {BATCH_MAX_MESSAGES})")
+    
+    workflow = _get_workflow_or_404(db, batch.workflow_id)
+    
+    # Compile the workflow and search the knowledge base once for the whole batch
+    with stage("workflow"):
+        settings = compile_workflow(workflow, workflow_versions.load_components(db, workflow))
+    with stage("kb_search"):
+        kb_hits = get_knowledge_base().search_many([text for text in batch.messages if classify_query(text).use_kb])
+    annotate(workflow_id=batch.workflow_id, batch_size=len(batch.messages), kb_docs_scanned=len(get_knowledge_base().documents))
+    print(f"📦 Batch chat: {len(batch.messages)} messages through '{settings['name']}'")
+    
+    web_searches: Dict[str, asyncio.Task] = {}
+    semaphore = asyncio.Semaphore(max(1, min(batch.concurrency, BATCH_MAX_CONCURRENCY)))
+    
+    def shared_web_search(query: str) -> asyncio.Task:
+        key = " ".join(query.lower().split())
+        if key not in web_searches:
+            web_searches[key] = asyncio.ensure_future(get_web_search().search(query))
+        return web_searches[key]
+    
+    priority = clamp_priority(batch.priority, BATCH_MIN_PRIORITY)
+    
+    async def admit_paced():
+        """Wait for capacity instead of failing fast; give up only on daily quota or after BATCH_MAX_WAIT"""
+        deadline = time.monotonic() + BATCH_MAX_WAIT
+        while True:
+            remaining = deadline - time.monotonic()
+            try:
+                return await get_admission().admit(get_ai_service().gemini_key, workflow.id, priority,
+                                                   max_wait=max(0.0, remaining))
+            except AdmissionRejected as e:
+                if e.reason == "daily_quota":
+                    raise
+                # queue_full reports the whole wait budget as retry_after; the queue frees up much sooner
+                backoff = BATCH_QUEUE_BACKOFF if e.reason == "queue_full" else e.retry_after
+                if backoff >= deadline - time.monotonic():
+                    raise
+                await asyncio.sleep(backoff)
+    
+    async def run_item(index: int, text: str) -> Dict[str, Any]:
+        async with semaphore:
+            try:
+                with item(index):
+                    intent = classify_query(text)
+                    annotate(route=intent.route, query_chars=len(text))
+                    with stage("admission"):
+                        ticket = await admit_paced()
+                    async with ticket:
+                        kb_results = kb_hits[text] if intent.use_kb else []
+                        web_context = ""
+                        if wants_web_search(intent, settings, kb_results):
+                            with stage("web_search"):
+                                web_context = await asyncio.shield(shared_web_search(text))
+                        prompt, kb_context = build_prompt(text, settings, web_context, kb_results)
+                        annotate(prompt_chars=len(prompt), kb_results=len(kb_results))
+                        with stage("llm"):
+                            response_text = await run_in_threadpool(get_ai_service().generate_response, prompt)
+                return {
+                    "index": index,
+                    "message": text,
+                    "response": response_text,
+                    "web_search_used": settings['web_search'] and bool(web_context),
+                    "kb_used": bool(kb_context)
+                }
+            except AdmissionRejected as e:
+                return {"index": index, "message": text, "error": e.reason, "retry_after": e.retry_after}
+            except Exception as e:
+                print(f"❌ Batch item {index} error: {e}")
+                return {"index": index, "message": text, "error": str(e)}
+    
+    async def stream():
+        tasks = [asyncio.ensure_future(run_item(i, text)) for i, text in enumerate(batch.messages)]
+        errors = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                result = await finished
+                errors += "error" in result
+                yield json.dumps(result) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+        yield json.dumps({
+            "done": True,
+            "workflow_used": settings['name'],
+            "total": len(tasks),
+            "errors": errors,
+            "web_searches": len(web_searches)
+        }) + "\n"
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
     
 @app.post("/api/upload-document")
 async def upload_document(file: UploadFile = File(...)):
@@ -446,7 +785,7 @@ async def upload_document(file: UploadFile = File(...)):
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
         
-        success = knowledge_base.add_document(file_path, file_id, file.filename)
+        success = get_knowledge_base().add_document(file_path, file_id, file.filename)
         
         if success:
             return {
@@ -470,7 +809,7 @@ async def search_knowledge(search_data: dict):
         if not query.strip():
             return {"results": [], "total_found": 0, "query": query}
         
-        results = knowledge_base.search(query)
+        results = get_knowledge_base().search(query)
         return {
             "results": results,
             "total_found": len(results),
@@ -484,7 +823,7 @@ async def get_documents():
     """Get list of all documents in knowledge base"""
     try:
         documents = []
-        for doc_id, doc_data in knowledge_base.documents.items():
+        for doc_id, doc_data in get_knowledge_base().documents.items():
             documents.append({
                 "id": doc_id,
                 "filename": doc_data['filename'],
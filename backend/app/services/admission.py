@@ -0,0 +1,313 @@
+import asyncio
+import heapq
+import itertools
+import math
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+# How often (seconds) idle token buckets are swept
+BUCKET_SWEEP_INTERVAL = 60.0
+
+
+class AdmissionRejected(Exception):
+    """Raised when an upstream LLM call cannot be admitted right now."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` stored."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until one token is available (0 if one is available now)."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        """Full again, so dropping it is the same as starting a fresh bucket."""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def drain(self, seconds: float):
+        """Push the bucket into debt so nothing is admitted for `seconds`."""
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+
+class AdmissionTicket:
+    """Holds one concurrency slot; released when the `async with` block exits."""
+
+    def __init__(self, controller: "AdmissionController", waited: float):
+        self.controller = controller
+        self.waited = waited
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.controller._release()
+        return False
+
+
+class AdmissionController:
+    """
+    Gatekeeper for upstream LLM calls.
+
+    A request is admitted only if the per-key and per-workflow token buckets
+    have a token, the daily quota for the key is not spent and a concurrency
+    slot is free. Requests that would wait longer than `max_wait` seconds, or
+    that find the waiting queue full, are rejected immediately with a
+    Retry-After hint instead of piling up behind a throttled upstream.
+    """
+
+    def __init__(self, key_rate_per_minute: float = 10, key_burst: int = 5,
+                 workflow_rate_per_minute: float = 6, workflow_burst: int = 3,
+                 daily_quota: int = 50, max_concurrency: int = 4,
+                 max_queue: int = 16, max_wait: float = 10.0):
+        self.key_rate = key_rate_per_minute / 60.0
+        self.key_burst = key_burst
+        self.workflow_rate = workflow_rate_per_minute / 60.0
+        self.workflow_burst = workflow_burst
+        self.daily_quota = daily_quota
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._key_buckets: Dict[str, TokenBucket] = {}
+        self._workflow_buckets: Dict[str, TokenBucket] = {}
+        self._quota_day = self._today()
+        self._quota_used: Dict[str, int] = {}
+        self._active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._admitted = 0
+        self._rejected: Dict[str, int] = {}
+        self._last_sweep = time.monotonic()
+
+    @staticmethod
+    def _today():
+        return datetime.now(timezone.utc).date()
+
+    @staticmethod
+    def _seconds_until_reset() -> float:
+        now = datetime.now(timezone.utc)
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+        return (midnight - now).total_seconds()
+
+    def _roll_day(self):
+        if self._today() != self._quota_day:
+            self._quota_day = self._today()
+            self._quota_used.clear()
+
+    def _bucket(self, buckets: Dict[str, TokenBucket], name: str, rate: float, burst: int) -> TokenBucket:
+        bucket = buckets.get(name)
+        if bucket is None:
+            bucket = buckets[name] = TokenBucket(rate, burst)
+        return bucket
+
+    def _evict_idle(self, now: float):
+        """Drop full buckets now and then so per-key/per-workflow state stays bounded."""
+        if now - self._last_sweep < BUCKET_SWEEP_INTERVAL:
+            return
+        self._last_sweep = now
+        for buckets in (self._key_buckets, self._workflow_buckets):
+            for name in [name for name, bucket in buckets.items() if bucket.idle(now)]:
+                del buckets[name]
+
+    def _reject(self, reason: str, retry_after: float):
+        self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        print(f"🚦 Rejected LLM call ({reason}), retry after {retry_after:.1f}s")
+        raise AdmissionRejected(reason, retry_after)
+
+    def _check_rate(self, api_key: str, workflow_id: str, max_wait: float) -> float:
+        """Reserve quota and bucket tokens; return how long to wait for them."""
+        now = time.monotonic()
+        self._roll_day()
+        self._evict_idle(now)
+        if self.daily_quota and self._quota_used.get(api_key, 0) >= self.daily_quota:
+            self._reject("daily_quota", self._seconds_until_reset())
+
+        key_bucket = self._bucket(self._key_buckets, api_key, self.key_rate, self.key_burst)
+        wf_bucket = self._bucket(self._workflow_buckets, workflow_id, self.workflow_rate, self.workflow_burst)
+        wait = max(key_bucket.wait_time(now), wf_bucket.wait_time(now))
+        if wait > max_wait:
+            self._reject("rate_limited", wait)
+
+        key_bucket.take()
+        wf_bucket.take()
+        self._quota_used[api_key] = self._quota_used.get(api_key, 0) + 1
+        return wait
+
+    def charge(self, api_key: str) -> bool:
+        """
+        Count one more upstream request of an admitted call (e.g. a fallback
+        model) against the daily quota. Returns False once the quota is spent.
+        """
+        api_key = api_key or "anonymous"
+        with self._lock:
+            self._roll_day()
+            used = self._quota_used.get(api_key, 0)
+            if self.daily_quota and used >= self.daily_quota:
+                self._rejected["daily_quota"] = self._rejected.get("daily_quota", 0) + 1
+                return False
+            self._quota_used[api_key] = used + 1
+            return True
+
+    def _refund(self, api_key: str, workflow_id: str):
+        """Give back what _check_rate reserved for a call that never reached Gemini."""
+        if self._quota_used.get(api_key, 0) > 0:
+            self._quota_used[api_key] -= 1
+        for bucket in (self._key_buckets.get(api_key), self._workflow_buckets.get(workflow_id)):
+            if bucket is not None:
+                bucket.tokens = min(bucket.capacity, bucket.tokens + 1)
+
+    async def admit(self, api_key: str, workflow_id: str, priority: int = 0,
+                    max_wait: Optional[float] = None) -> AdmissionTicket:
+        """
+        Admit one LLM call or raise AdmissionRejected.
+
+        Lower `priority` values are served first when callers are queued for
+        a concurrency slot. `max_wait` overrides how long this caller is
+        willing to wait (background work such as batches waits longer).
+        """
+        started = time.monotonic()
+        api_key = api_key or "anonymous"
+        workflow_id = str(workflow_id)
+        max_wait = self.max_wait if max_wait is None else max_wait
+
+        with self._lock:
+            if self._active >= self.max_concurrency and len(self._waiters) >= self.max_queue:
+                self._reject("queue_full", max_wait)
+            wait = self._check_rate(api_key, workflow_id, max_wait)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                with self._lock:
+                    self._refund(api_key, workflow_id)
+                raise
+
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                self._admitted += 1
+                return AdmissionTicket(self, time.monotonic() - started)
+            if len(self._waiters) >= self.max_queue:
+                self._refund(api_key, workflow_id)
+                self._reject("queue_full", max_wait)
+            future = loop.create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), future))
+
+        remaining = max(0.0, max_wait - (time.monotonic() - started))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=remaining)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if future.done():
+                    # Slot was handed over just as we timed out - keep it.
+                    self._admitted += 1
+                    return AdmissionTicket(self, time.monotonic() - started)
+                future.cancel()
+                self._waiters = [w for w in self._waiters if w[2] is not future]
+                heapq.heapify(self._waiters)
+                self._refund(api_key, workflow_id)
+                self._reject("queue_timeout", max_wait)
+        except asyncio.CancelledError:
+            with self._lock:
+                handed_over = future.done() and not future.cancelled()
+                if not handed_over:
+                    future.cancel()
+                    self._waiters = [w for w in self._waiters if w[2] is not future]
+                    heapq.heapify(self._waiters)
+                self._refund(api_key, workflow_id)
+            if handed_over:
+                # We own a slot nobody will use - pass it on.
+                self._release()
+            raise
+
+        with self._lock:
+            self._admitted += 1
+        return AdmissionTicket(self, time.monotonic() - started)
+
+    def _release(self):
+        with self._lock:
+            while self._waiters:
+                _, _, future = heapq.heappop(self._waiters)
+                if not future.done():
+                    # Hand the slot straight to the next waiter.
+                    future.get_loop().call_soon_threadsafe(self._hand_over, future)
+                    return
+            self._active -= 1
+
+    def _hand_over(self, future: asyncio.Future):
+        if not future.done():
+            future.set_result(True)
+        else:
+            # Waiter gave up between pop and hand over; pass the slot on.
+            self._release()
+
+    def cool_down(self, api_key: str, seconds: float):
+        """Stop admitting calls for `api_key` for a while after upstream throttling."""
+        api_key = api_key or "anonymous"
+        with self._lock:
+            bucket = self._bucket(self._key_buckets, api_key, self.key_rate, self.key_burst)
+            bucket._refill(time.monotonic())
+            bucket.drain(seconds)
+        print(f"🚦 Cooling down LLM calls for {seconds:.0f}s after upstream throttling")
+
+    def stats(self, api_key: Optional[str] = None) -> Dict:
+        """Live view of quota usage, bucket levels and queue depth."""
+        now = time.monotonic()
+        with self._lock:
+            self._roll_day()
+            keys = [api_key or "anonymous"] if api_key is not None else list(self._key_buckets)
+            quota = {}
+            for index, key in enumerate(keys):
+                used = self._quota_used.get(key, 0)
+                bucket = self._key_buckets.get(key)
+                if bucket:
+                    bucket._refill(now)
+                quota[f"key_{index}"] = {
+                    "used_today": used,
+                    "daily_quota": self.daily_quota or None,
+                    "remaining_today": max(0, self.daily_quota - used) if self.daily_quota else None,
+                    "tokens_available": round(bucket.tokens, 2) if bucket else self.key_burst,
+                }
+            workflows = {}
+            for workflow_id, bucket in self._workflow_buckets.items():
+                bucket._refill(now)
+                workflows[workflow_id] = round(bucket.tokens, 2)
+            return {
+                "quota": quota,
+                "quota_resets_in": int(self._seconds_until_reset()),
+                "workflow_tokens": workflows,
+                "active": self._active,
+                "queued": sum(1 for _, _, f in self._waiters if not f.done()),
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": dict(self._rejected),
+            }
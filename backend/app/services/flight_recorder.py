@@ -0,0 +1,290 @@
+"""
+Slow-request flight recorder and opt-in sampling profiler.
+
+Each request handled while the recorder is enabled gets a RequestTrace
+in a context variable. Code marks its stages with `with stage("llm"):`
+and adds facts with `annotate(model=...)`. Work done for one part of a
+request (a message of a batch) can be grouped with `with item(key):`, so
+its stages and facts are kept apart from the other parts. Requests slower
+than the threshold are kept in a bounded ring buffer. When no trace is active,
+stage() returns a shared no-op context manager and annotate() returns at
+once, so instrumented code costs next to nothing while the recorder is
+off.
+
+A sampled fraction of requests can also be profiled. A background
+thread snapshots the stacks of the threads doing work for those requests
+at a fixed interval and keeps collapsed stack counts. The event-loop
+thread is shared with concurrent requests, so its samples can include
+their frames.
+"""
+import contextvars
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+_current: contextvars.ContextVar = contextvars.ContextVar("flowintellect_trace", default=None)
+_current_item: contextvars.ContextVar = contextvars.ContextVar("flowintellect_trace_item", default=None)
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("trace", "name", "stages", "started")
+
+    def __init__(self, trace: "RequestTrace", name: str, stages: List[Dict[str, Any]]):
+        self.trace = trace
+        self.name = name
+        self.stages = stages
+
+    def __enter__(self):
+        self.trace.threads.add(threading.get_ident())
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = (time.perf_counter() - self.started) * 1000
+        if threading.get_ident() != self.trace.owner_thread:
+            # Worker thread goes back to the pool; stop sampling it for this request
+            self.trace.threads.discard(threading.get_ident())
+        self.stages.append({
+            "stage": self.name,
+            "start_ms": round((self.started - self.trace.started) * 1000, 1),
+            "ms": round(elapsed, 1),
+            "error": exc_type.__name__ if exc_type else None,
+        })
+        return False
+
+
+class _Item:
+    __slots__ = ("record", "token")
+
+    def __init__(self, record: Dict[str, Any]):
+        self.record = record
+
+    def __enter__(self):
+        self.token = _current_item.set(self.record)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current_item.reset(self.token)
+        return False
+
+
+class RequestTrace:
+    def __init__(self, request_id: int, method: str, path: str, profile: bool):
+        self.id = request_id
+        self.method = method
+        self.path = path
+        self.profile = profile
+        self.started = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc)
+        self.stages: List[Dict[str, Any]] = []
+        self.annotations: Dict[str, Any] = {}
+        self.items: Dict[str, Dict[str, Any]] = {}
+        self.owner_thread = threading.get_ident()
+        self.threads = {self.owner_thread}
+        self.samples: Counter = Counter()
+        self.duration_ms: Optional[float] = None
+        self.status_code: Optional[int] = None
+
+    def to_dict(self, top: int = 25) -> Dict[str, Any]:
+        record = {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": self.duration_ms,
+            "stages": self.stages,
+            **self.annotations,
+        }
+        if self.items:
+            record["items"] = self.items
+        if self.profile:
+            total = sum(self.samples.values())
+            record["profile"] = {
+                "samples": total,
+                "top_stacks": [
+                    {"stack": stack, "samples": count, "pct": round(100 * count / total, 1)}
+                    for stack, count in self.samples.most_common(top)
+                ],
+            }
+        return record
+
+
+class _StackSampler:
+    """One background thread sampling the stacks of threads owned by profiled traces."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.active = set()
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+
+    def add(self, trace: RequestTrace):
+        with self.lock:
+            self.active.add(trace)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="flight-recorder-sampler", daemon=True)
+                self.thread.start()
+
+    def remove(self, trace: RequestTrace):
+        with self.lock:
+            self.active.discard(trace)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            with self.lock:
+                traces = list(self.active)
+                if not traces:
+                    self.thread = None
+                    return
+            frames = sys._current_frames()
+            for trace in traces:
+                for thread_id in list(trace.threads):
+                    frame = frames.get(thread_id)
+                    if frame is None or thread_id == me:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < 40:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                        frame = frame.f_back
+                    trace.samples[";".join(reversed(stack))] += 1
+            del frames
+            time.sleep(self.interval)
+
+
+class FlightRecorder:
+    def __init__(self, enabled: bool = False, capacity: int = 100, slow_ms: float = 2000,
+                 profile_rate: float = 0.0, profile_interval_ms: float = 5.0):
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        self.profile_rate = profile_rate
+        self.records: deque = deque(maxlen=capacity)
+        # Profiled requests that were not slow; kept apart so they never push out slow ones
+        self.profiles: deque = deque(maxlen=capacity)
+        self.seen = 0
+        self._ids = itertools.count(1)
+        self._sampler = _StackSampler(profile_interval_ms / 1000.0)
+
+    def start(self, method: str, path: str, force_profile: bool = False):
+        """Begin tracing the current request; returns a token for finish()."""
+        profile = force_profile or (self.profile_rate > 0 and random.random() < self.profile_rate)
+        trace = RequestTrace(next(self._ids), method, path, profile)
+        if profile:
+            self._sampler.add(trace)
+        return trace, _current.set(trace)
+
+    def finish(self, started, status_code: Optional[int] = None):
+        trace, token = started
+        _current.reset(token)
+        if trace.profile:
+            self._sampler.remove(trace)
+        trace.duration_ms = round((time.perf_counter() - trace.started) * 1000, 1)
+        trace.status_code = status_code
+        self.seen += 1
+        if trace.duration_ms >= self.slow_ms:
+            self.records.append(trace)
+        elif trace.profile:
+            self.profiles.append(trace)
+        return trace
+
+    def slow_requests(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        records = list(self.records)[::-1]
+        return [trace.to_dict() for trace in records[:limit]]
+
+    def profiled_requests(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        records = list(self.profiles)[::-1]
+        return [trace.to_dict() for trace in records[:limit]]
+
+    def get(self, request_id: int) -> Optional[Dict[str, Any]]:
+        for trace in list(self.records) + list(self.profiles):
+            if trace.id == request_id:
+                return trace.to_dict(top=100)
+        return None
+
+    def clear(self):
+        self.records.clear()
+        self.profiles.clear()
+
+
+class FlightRecorderMiddleware:
+    """
+    Pure ASGI middleware tracing every HTTP request.
+
+    The trace is finished when the wrapped app returns, i.e. after the last
+    body chunk has been sent, so streamed responses are timed end to end.
+    """
+
+    def __init__(self, app, get_recorder, authorize_profile=None):
+        self.app = app
+        self.get_recorder = get_recorder
+        # Called with the X-Admin-Token value; X-Profile is ignored unless it returns True
+        self.authorize_profile = authorize_profile
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        recorder = self.get_recorder()
+        headers = dict(scope.get("headers", []))
+        force_profile = (headers.get(b"x-profile") == b"1" and self.authorize_profile is not None
+                         and self.authorize_profile(headers.get(b"x-admin-token", b"").decode("latin-1")))
+        started = recorder.start(scope["method"], scope["path"], force_profile=force_profile)
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            recorder.finish(started, status_code)
+
+
+def item(key: str):
+    """Group the stages and annotations inside the block under `key` of the current request."""
+    trace = _current.get()
+    if trace is None:
+        return _NULL_STAGE
+    record = trace.items.setdefault(str(key), {"stages": []})
+    return _Item(record)
+
+
+def stage(name: str):
+    """Time a block of work as a named stage of the current request (or item)."""
+    trace = _current.get()
+    if trace is None:
+        return _NULL_STAGE
+    record = _current_item.get()
+    return _Stage(trace, name, record["stages"] if record is not None else trace.stages)
+
+
+def annotate(**values):
+    """Attach facts (prompt size, model, retrieval stats...) to the current request (or item)."""
+    trace = _current.get()
+    if trace is not None:
+        record = _current_item.get()
+        (record if record is not None else trace.annotations).update(values)
@@ -0,0 +1,97 @@
+import functools
+import re
+from typing import FrozenSet, NamedTuple
+
+# Compiled once at import. Whole-message matches only, so "which airlines
+# fly to Ohio" is no longer mistaken for a greeting because it contains "hi".
+_SMALL_TALK_PHRASE = r"""
+    (?:hi|hello|hey|hiya|yo|greetings|howdy
+      |good\s+(?:morning|afternoon|evening|night)
+      |how\s+are\s+you(?:\s+doing)?(?:\s+today)?
+      |how's\s+it\s+going
+      |what(?:'s|\s+is)\s+your\s+name
+      |who\s+are\s+you
+      |(?:thanks|thank\s+you)(?:\s+so\s+much)?|thx|ty
+      |ok(?:ay)?|cool|nice|great
+      |bye|goodbye|see\s+you)
+    (?:\s+(?:there|everyone|all|bot|friend|again))?
+"""
+
+# Phrases must be separated by punctuation or whitespace, so each input has
+# a single way to split into phrases and the repetition cannot backtrack
+# exponentially on near-misses like "thank you thank you ... x".
+_SMALL_TALK = re.compile(
+    rf"""^\s*{_SMALL_TALK_PHRASE}(?:[\s!?.,:)(-]+{_SMALL_TALK_PHRASE})*[\s!?.,:)(-]*$""",
+    re.IGNORECASE | re.VERBOSE,
+)
+
+# Arithmetic is checked with a plain character class plus set lookups, so
+# it stays linear on long digit strings
+_ARITHMETIC_CHARS = re.compile(r"[\d\s+\-*/().^%=?]+")
+_DIGITS = frozenset("0123456789")
+_OPERATORS = frozenset("+*^%=")
+# "-" and "/" between digits are usually ranges, dates or phone numbers
+# ("2024-2025", "1/1/2024", "555-1234"), so they only count with spaces
+_SPACED_OPERATORS = (" - ", " / ")
+
+# Only the user's own documents: "my files", "the uploaded pdf", "knowledge
+# base". Plain "documents" or "files" ("share files on Google Drive") is a
+# web question.
+_KNOWLEDGE_BASE = re.compile(
+    r"\b(?:(?:my|our)\s+(?:uploaded\s+|attached\s+)?(?:documents?|docs?|pdfs?|files?|attachments?|uploads?|notes)"
+    r"|the\s+(?:uploaded|attached)\s+(?:documents?|docs?|pdfs?|files?)"
+    r"|knowledge\s+base)\b",
+    re.IGNORECASE,
+)
+
+_TOKEN = re.compile(r"\w+")
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it me my of on or
+please tell that the their there this to was what when where which who why
+will with you your about
+""".split())
+
+
+class QueryIntent(NamedTuple):
+    route: str            # "direct", "kb" or "web"
+    use_web: bool
+    use_kb: bool
+    keywords: FrozenSet[str]
+
+
+def is_arithmetic(text: str) -> bool:
+    """Plain arithmetic such as "12 * (3 + 4)"; a bare number or date is not."""
+    if not _ARITHMETIC_CHARS.fullmatch(text):
+        return False
+    chars = set(text)
+    if chars.isdisjoint(_DIGITS):
+        return False
+    return not chars.isdisjoint(_OPERATORS) or any(op in text for op in _SPACED_OPERATORS)
+
+
+def tokenize(text: str) -> FrozenSet[str]:
+    """Lowercased word tokens of `text`."""
+    return frozenset(_TOKEN.findall(text.lower()))
+
+
+def keywords(text: str) -> FrozenSet[str]:
+    """Tokens without stopwords (all tokens if nothing else is left)."""
+    tokens = tokenize(text)
+    return (tokens - STOPWORDS) or tokens
+
+
+@functools.lru_cache(maxsize=4096)
+def classify_query(query: str) -> QueryIntent:
+    """
+    Route a query in a single pass:
+      direct - small talk or plain arithmetic, answer without retrieval
+      kb     - the user refers to their documents, knowledge base only
+               (callers fall back to the web if it has no answer)
+      web    - anything else, web search (if enabled) plus knowledge base
+    """
+    if not query.strip() or _SMALL_TALK.match(query) or is_arithmetic(query):
+        return QueryIntent("direct", False, False, frozenset())
+    if _KNOWLEDGE_BASE.search(query):
+        return QueryIntent("kb", False, True, keywords(query))
+    return QueryIntent("web", True, True, keywords(query))
@@ -0,0 +1,284 @@
+import hashlib
+import math
+import os
+import random
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+SERPAPI_URL = "https://serpapi.com/search"
+
+
+# Real upstream backends
+
+class GeminiBackend:
+    """Calls the Gemini REST API. Returns (status_code, json_body)."""
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, base_url: Optional[str] = None):
+        self.api_key = api_key
+        self.base_url = (base_url or os.getenv('GEMINI_API_BASE', GEMINI_API_BASE)).rstrip('/')
+
+    def generate(self, model: str, payload: Dict[str, Any], timeout: float = 30) -> Tuple[int, Dict[str, Any]]:
+        import requests
+        url = f"{self.base_url}/models/{model}:generateContent?key={self.api_key}"
+        response = requests.post(url, json=payload, timeout=timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+
+class SerpApiBackend:
+    """Calls SerpAPI. Returns (status_code, json_body)."""
+
+    name = "serpapi"
+
+    def __init__(self, api_key: str, url: Optional[str] = None):
+        self.api_key = api_key
+        self.url = url or os.getenv('SERPAPI_URL', SERPAPI_URL)
+
+    def search(self, params: Dict[str, Any], timeout: float = 30) -> Tuple[int, Dict[str, Any]]:
+        import requests
+        response = requests.get(self.url, params={**params, 'api_key': self.api_key}, timeout=timeout)
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+        return response.status_code, body
+
+
+# Offline simulators
+
+class LatencyModel:
+    """
+    Latency distribution parsed from a spec string (milliseconds):
+      "fixed:200", "uniform:100:500", "normal:300:50",
+      "lognormal:800:0.5" (median, sigma) or "exponential:400" (mean)
+    """
+
+    ARGS = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exponential": 1}
+
+    def __init__(self, spec: str = "lognormal:800:0.5"):
+        parts = spec.split(":")
+        self.kind = parts[0]
+        if self.kind not in self.ARGS:
+            raise ValueError(f"Unknown latency distribution: {spec}")
+        if len(parts) - 1 != self.ARGS[self.kind]:
+            raise ValueError(f"Latency '{self.kind}' takes {self.ARGS[self.kind]} argument(s): {spec}")
+        self.args = [float(p) for p in parts[1:]]
+        if self.kind in ("lognormal", "exponential") and self.args[0] <= 0:
+            raise ValueError(f"Latency '{self.kind}' needs a positive first argument: {spec}")
+        self.spec = spec
+
+    def sample(self, rng: random.Random) -> float:
+        """Return one latency sample in seconds."""
+        if self.kind == "fixed":
+            ms = self.args[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(self.args[0], self.args[1])
+        elif self.kind == "normal":
+            ms = rng.gauss(self.args[0], self.args[1])
+        elif self.kind == "lognormal":
+            ms = rng.lognormvariate(math.log(self.args[0]), self.args[1])
+        else:
+            ms = rng.expovariate(1.0 / self.args[0])
+        return max(0.0, ms) / 1000.0
+
+
+class _Simulator:
+    """Shared knobs: latency distribution, error rate and a seed for determinism."""
+
+    def __init__(self, latency: str, error_rate: float, seed: str):
+        self.latency = LatencyModel(latency)
+        self.error_rate = error_rate
+        self.seed = seed
+
+    def _rng(self, *key: str) -> random.Random:
+        # Same seed + same input -> same latency, same error and same text
+        digest = hashlib.sha256(":".join((self.seed,) + key).encode()).hexdigest()
+        return random.Random(int(digest[:16], 16))
+
+    def _fail(self, rng: random.Random) -> Optional[Tuple[int, Dict[str, Any]]]:
+        if rng.random() >= self.error_rate:
+            return None
+        status = rng.choice([429, 500, 503])
+        messages = {
+            429: "Resource has been exhausted (e.g. check quota).",
+            500: "An internal error has occurred.",
+            503: "The model is overloaded. Please try again later.",
+        }
+        return status, {"error": {"code": status, "message": messages[status], "status": "SIMULATED"}}
+
+
+_WORDS = ("the", "workflow", "answer", "context", "model", "result", "data", "flow",
+          "search", "document", "helpful", "question", "system", "response", "value")
+
+
+class SimulatedGeminiBackend(_Simulator):
+    """
+    Offline stand-in for Gemini. Produces the same body shape as
+    generateContent (candidates[0].content.parts[0].text, usageMetadata)
+    with configurable latency, error rate and streaming chunk timing.
+    """
+
+    name = "simulator"
+
+    def __init__(self, latency: str = "lognormal:800:0.5", error_rate: float = 0.0, seed: str = "0",
+                 tokens_per_second: float = 200.0, stream_chunks: int = 4):
+        super().__init__(latency, error_rate, seed)
+        self.tokens_per_second = tokens_per_second
+        self.stream_chunks = max(1, stream_chunks)
+
+    @staticmethod
+    def _prompt(payload: Dict[str, Any]) -> str:
+        try:
+            return payload["contents"][0]["parts"][0]["text"]
+        except (KeyError, IndexError, TypeError):
+            return ""
+
+    def _text(self, rng: random.Random, max_tokens: int) -> str:
+        count = min(max_tokens, rng.randint(20, 120))
+        words = [rng.choice(_WORDS) for _ in range(count)]
+        return f"[simulated] {' '.join(words)}."
+
+    def _body(self, text: str, prompt: str, finish: Optional[str] = "STOP") -> Dict[str, Any]:
+        candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+        if finish:
+            candidate["finishReason"] = finish
+        return {
+            "candidates": [candidate],
+            "usageMetadata": {
+                "promptTokenCount": len(prompt.split()),
+                "candidatesTokenCount": len(text.split()),
+                "totalTokenCount": len(prompt.split()) + len(text.split()),
+            },
+        }
+
+    def generate(self, model: str, payload: Dict[str, Any], timeout: float = 30) -> Tuple[int, Dict[str, Any]]:
+        prompt = self._prompt(payload)
+        rng = self._rng(model, prompt)
+        first_token = self.latency.sample(rng)
+        failure = self._fail(rng)
+        if failure:
+            time.sleep(min(first_token, timeout))
+            return failure
+        max_tokens = payload.get("generationConfig", {}).get("maxOutputTokens", 1000)
+        text = self._text(rng, max_tokens)
+        elapsed = first_token + len(text.split()) / self.tokens_per_second
+        if elapsed > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Simulated Gemini call exceeded {timeout}s")
+        time.sleep(elapsed)
+        return 200, self._body(text, prompt)
+
+    def open_stream(self, model: str, payload: Dict[str, Any]) -> Tuple[int, Any]:
+        """
+        Wait for the first token, then return (200, chunk iterator) or
+        (status, error body), so callers can fail before streaming starts.
+        """
+        prompt = self._prompt(payload)
+        rng = self._rng(model, prompt)
+        time.sleep(self.latency.sample(rng))
+        failure = self._fail(rng)
+        if failure:
+            return failure
+        return 200, self._chunks(rng, prompt, payload)
+
+    def _chunks(self, rng: random.Random, prompt: str, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        max_tokens = payload.get("generationConfig", {}).get("maxOutputTokens", 1000)
+        words = self._text(rng, max_tokens).split(" ")
+        size = math.ceil(len(words) / self.stream_chunks)
+        for start in range(0, len(words), size):
+            chunk = words[start:start + size]
+            if start:
+                time.sleep(len(chunk) / self.tokens_per_second)
+            last = start + size >= len(words)
+            yield self._body(" ".join(chunk) + ("" if last else " "), prompt, "STOP" if last else None)
+
+
+class SimulatedSerpApiBackend(_Simulator):
+    """Offline stand-in for SerpAPI returning organic_results and, sometimes, an answer_box."""
+
+    name = "simulator"
+
+    def __init__(self, latency: str = "lognormal:600:0.4", error_rate: float = 0.0, seed: str = "0",
+                 answer_box_rate: float = 0.3):
+        super().__init__(latency, error_rate, seed)
+        self.answer_box_rate = answer_box_rate
+
+    def search(self, params: Dict[str, Any], timeout: float = 30) -> Tuple[int, Dict[str, Any]]:
+        query = str(params.get('q', ''))
+        rng = self._rng(query)
+        delay = self.latency.sample(rng)
+        if delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Simulated SerpAPI call exceeded {timeout}s")
+        time.sleep(delay)
+        failure = self._fail(rng)
+        if failure:
+            return failure[0], {"error": failure[1]["error"]["message"]}
+
+        words = query.split() or ["result"]
+        organic = []
+        for position in range(1, int(params.get('num', 3)) + 1):
+            topic = " ".join(rng.sample(words, k=min(len(words), 3)))
+            organic.append({
+                "position": position,
+                "title": f"{topic.title()} - Simulated Source {position}",
+                "link": f"https://example.com/{position}/{hashlib.md5(query.encode()).hexdigest()[:8]}",
+                "snippet": f"Simulated snippet about {query}: {' '.join(rng.choice(_WORDS) for _ in range(12))}.",
+            })
+        body = {
+            "search_metadata": {"status": "Success", "simulated": True},
+            "search_parameters": {"q": query, "engine": params.get('engine', 'google')},
+            "organic_results": organic,
+        }
+        if rng.random() < self.answer_box_rate:
+            body["answer_box"] = {"type": "organic_result", "snippet": f"Simulated direct answer for {query}."}
+        return 200, body
+
+
+# Factories chosen by configuration
+
+def make_simulated_llm() -> SimulatedGeminiBackend:
+    """Gemini simulator configured from the SIM_LLM_* settings"""
+    return SimulatedGeminiBackend(
+        latency=os.getenv('SIM_LLM_LATENCY', 'lognormal:800:0.5'),
+        error_rate=float(os.getenv('SIM_LLM_ERROR_RATE', '0')),
+        seed=os.getenv('SIM_SEED', '0'),
+        tokens_per_second=float(os.getenv('SIM_LLM_TOKENS_PER_SECOND', '200')),
+        stream_chunks=int(os.getenv('SIM_LLM_STREAM_CHUNKS', '4')),
+    )
+
+
+def make_simulated_search() -> SimulatedSerpApiBackend:
+    """SerpAPI simulator configured from the SIM_SEARCH_* settings"""
+    return SimulatedSerpApiBackend(
+        latency=os.getenv('SIM_SEARCH_LATENCY', 'lognormal:600:0.4'),
+        error_rate=float(os.getenv('SIM_SEARCH_ERROR_RATE', '0')),
+        seed=os.getenv('SIM_SEED', '0'),
+        answer_box_rate=float(os.getenv('SIM_SEARCH_ANSWER_BOX_RATE', '0.3')),
+    )
+
+
+def make_llm_backend(api_key: Optional[str]):
+    """LLM_PROVIDER=gemini (default) or simulator"""
+    provider = os.getenv('LLM_PROVIDER', 'gemini').lower()
+    if provider == 'simulator':
+        return make_simulated_llm()
+    if provider != 'gemini':
+        raise ValueError(f"Unknown LLM_PROVIDER: {provider}")
+    return GeminiBackend(api_key)
+
+
+def make_search_backend(api_key: Optional[str]):
+    """SEARCH_PROVIDER=serpapi (default) or simulator"""
+    provider = os.getenv('SEARCH_PROVIDER', 'serpapi').lower()
+    if provider == 'simulator':
+        return make_simulated_search()
+    if provider != 'serpapi':
+        raise ValueError(f"Unknown SEARCH_PROVIDER: {provider}")
+    return SerpApiBackend(api_key)
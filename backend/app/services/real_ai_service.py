@@ -1,5 +1,4 @@
 import os
-import google.generativeai as genai
 from typing import Dict, Any
 from dotenv import load_dotenv
 
@@ -12,6 +11,8 @@ class RealAIService:
     
     async def get_response(self, query: str, context: str = None) -> str:
         try:
+            import google.generativeai as genai
+
             # Configure Gemini
             genai.configure(api_key=self.api_key)
  
@@ -1,5 +1,4 @@
 import os
-import serpapi
 from dotenv import load_dotenv
 
 load_dotenv('../.env')
@@ -11,6 +10,7 @@ class RealWebSearchService:
             if not api_key:
                 return ["SerpAPI key not configured"]
                 
+            import serpapi
             client = serpapi.Client(api_key=api_key)
             results = client.search({
                 'q': query,
@@ -0,0 +1,51 @@
+"""
+Standalone HTTP simulator for Gemini and SerpAPI.
+
+Run it on an air-gapped box and point the real backends at it, so load
+tests also exercise the HTTP client path:
+
+    python -m uvicorn app.services.simulator_server:app --port 9000
+    GEMINI_API_BASE=http://localhost:9000/v1beta
+    SERPAPI_URL=http://localhost:9000/search
+
+Latency, error rate and seed use the same SIM_* settings as the
+in-process simulators (see providers.py).
+"""
+import json
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.services.providers import make_simulated_llm, make_simulated_search
+
+llm = make_simulated_llm()
+search = make_simulated_search()
+
+app = FastAPI(title="FlowIntellect upstream simulator")
+
+
+@app.post("/v1beta/models/{model_action}")
+async def generate(model_action: str, request: Request):
+    model, _, action = model_action.partition(":")
+    payload = await request.json()
+    if action == "generateContent":
+        status, body = await run_in_threadpool(llm.generate, model, payload)
+        return JSONResponse(body, status_code=status)
+    if action == "streamGenerateContent":
+        # Errors must be decided before the 200 and the event stream start
+        status, result = await run_in_threadpool(llm.open_stream, model, payload)
+        if status != 200:
+            return JSONResponse(result, status_code=status)
+
+        def events():
+            for chunk in result:
+                yield f"data: {json.dumps(chunk)}\r\n\r\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+    raise HTTPException(404, f"Unknown action: {action}")
+
+
+@app.get("/search")
+async def serp_search(request: Request):
+    status, body = await run_in_threadpool(search.search, dict(request.query_params))
+    return JSONResponse(body, status_code=status)
@@ -0,0 +1,240 @@
+"""
+Workflow version storage.
+
+Version 1 of a workflow is the snapshot in `workflows.components`. Every
+later save adds one row to `workflow_versions` holding a JSON Patch
+(RFC 6902) against the previous version. Every WORKFLOW_SNAPSHOT_EVERY
+versions - or whenever the patch would be larger than the graph itself -
+a full snapshot is stored instead, so rebuilding any version never
+replays more than a bounded number of patches.
+"""
+import copy
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from sqlalchemy.orm import Session
+
+from app.database_models import WorkflowDB, WorkflowVersionDB
+
+CACHE_SIZE = 64
+
+
+def snapshot_every() -> int:
+    """WORKFLOW_SNAPSHOT_EVERY, read on use so a value from .env is honoured"""
+    value = int(os.getenv('WORKFLOW_SNAPSHOT_EVERY', '20'))
+    if value < 1:
+        raise ValueError(f"WORKFLOW_SNAPSHOT_EVERY must be at least 1, got {value}")
+    return value
+
+
+# JSON Patch (add / remove / replace subset of RFC 6902)
+
+def _escape(token) -> str:
+    return str(token).replace("~", "~0").replace("/", "~1")
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+def _canonical(value: Any) -> str:
+    # Type-strict equality: 1, 1.0 and True compare equal in Python but not in JSON
+    return json.dumps(value, sort_keys=True)
+
+def make_patch(old: Any, new: Any, path: str = "") -> List[dict]:
+    """Return the JSON Patch operations that turn `old` into `new`."""
+    if type(old) is not type(new):
+        return [{"op": "replace", "path": path, "value": new}]
+
+    if isinstance(old, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+            else:
+                ops.extend(make_patch(old[key], value, f"{path}/{_escape(key)}"))
+        return ops
+
+    if isinstance(old, list):
+        # Trim the common prefix and suffix so inserting or deleting one node
+        # in the middle of a canvas yields a single operation
+        old_keys = [_canonical(value) for value in old]
+        new_keys = [_canonical(value) for value in new]
+        prefix = 0
+        while prefix < min(len(old), len(new)) and old_keys[prefix] == new_keys[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < min(len(old), len(new)) - prefix
+               and old_keys[len(old) - 1 - suffix] == new_keys[len(new) - 1 - suffix]):
+            suffix += 1
+        old_mid = old[prefix:len(old) - suffix]
+        new_mid = new[prefix:len(new) - suffix]
+        shared = min(len(old_mid), len(new_mid))
+
+        ops = []
+        for i in range(shared):
+            ops.extend(make_patch(old_mid[i], new_mid[i], f"{path}/{prefix + i}"))
+        for _ in range(len(old_mid) - shared):
+            ops.append({"op": "remove", "path": f"{path}/{prefix + shared}"})
+        for i in range(shared, len(new_mid)):
+            ops.append({"op": "add", "path": f"{path}/{prefix + i}", "value": new_mid[i]})
+        return ops
+
+    return [] if old == new else [{"op": "replace", "path": path, "value": new}]
+
+def apply_patch(document: Any, patch: List[dict]) -> Any:
+    """Apply JSON Patch operations to a copy of `document`."""
+    return _apply_in_place(copy.deepcopy(document), patch)
+
+def _apply_in_place(document: Any, patch: List[dict]) -> Any:
+    """Apply JSON Patch operations to `document` itself; returns the (possibly new) root."""
+    for op in patch:
+        if op["path"] == "":
+            document = copy.deepcopy(op["value"])
+            continue
+        tokens = [_unescape(t) for t in op["path"].split("/")[1:]]
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+        if isinstance(parent, list):
+            index = len(parent) if last == "-" else int(last)
+            if op["op"] == "add":
+                parent.insert(index, copy.deepcopy(op["value"]))
+            elif op["op"] == "remove":
+                del parent[index]
+            else:
+                parent[index] = copy.deepcopy(op["value"])
+        else:
+            if op["op"] == "remove":
+                del parent[last]
+            else:
+                parent[last] = copy.deepcopy(op["value"])
+    return document
+
+
+# Version storage
+
+_cache: "OrderedDict[tuple, Any]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _cached(key: tuple) -> Optional[Any]:
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    return None
+
+def _remember(key: tuple, components: Any):
+    with _cache_lock:
+        _cache[key] = components
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def _forget(workflow_id: int):
+    with _cache_lock:
+        for key in [k for k in _cache if k[0] == workflow_id]:
+            del _cache[key]
+
+def load_components(db: Session, workflow: WorkflowDB, version: Optional[int] = None) -> Any:
+    """
+    Rebuild the React Flow graph of `workflow` at `version` (latest by default).
+    The result is shared with a small cache - treat it as read-only.
+    """
+    version = version or workflow.version or 1
+    if version < 1 or version > (workflow.version or 1):
+        raise ValueError(f"Workflow {workflow.id} has no version {version}")
+
+    key = (workflow.id, version)
+    components = _cached(key)
+    if components is not None:
+        return components
+
+    snapshot = (
+        db.query(WorkflowVersionDB)
+        .filter(WorkflowVersionDB.workflow_id == workflow.id,
+                WorkflowVersionDB.version <= version,
+                WorkflowVersionDB.kind == "snapshot")
+        .order_by(WorkflowVersionDB.version.desc())
+        .first()
+    )
+    components, start = (snapshot.data, snapshot.version) if snapshot else (workflow.components, 1)
+    # One copy of the base version; every patch is then applied to it in place
+    components = copy.deepcopy(components)
+
+    patches = (
+        db.query(WorkflowVersionDB)
+        .filter(WorkflowVersionDB.workflow_id == workflow.id,
+                WorkflowVersionDB.version > start,
+                WorkflowVersionDB.version <= version)
+        .order_by(WorkflowVersionDB.version)
+        .all()
+    )
+    for row in patches:
+        components = _apply_in_place(components, row.data)
+
+    _remember(key, components)
+    return components
+
+def create_workflow(db: Session, name: str, components: Any) -> WorkflowDB:
+    workflow = WorkflowDB(name=name, components=components, version=1)
+    db.add(workflow)
+    db.commit()
+    db.refresh(workflow)
+    return workflow
+
+def save_version(db: Session, workflow: WorkflowDB, components: Optional[Any] = None,
+                 name: Optional[str] = None) -> bool:
+    """
+    Store `components` as the next version of `workflow`.
+    With `components=None` only the name is updated. Returns False when
+    nothing changed. Only the diff is written.
+    """
+    patch = [] if components is None else make_patch(load_components(db, workflow), components)
+    renamed = name is not None and name != workflow.name
+    if not patch and not renamed:
+        return False
+
+    if renamed:
+        workflow.name = name
+    if patch:
+        next_version = workflow.version + 1
+        snapshot = (next_version % snapshot_every() == 0
+                    or len(json.dumps(patch)) >= len(json.dumps(components)))
+        db.add(WorkflowVersionDB(
+            workflow_id=workflow.id,
+            version=next_version,
+            kind="snapshot" if snapshot else "patch",
+            data=components if snapshot else patch,
+        ))
+        workflow.version = next_version
+    db.commit()
+    db.refresh(workflow)
+    if patch:
+        _remember((workflow.id, workflow.version), copy.deepcopy(components))
+    return True
+
+def list_versions(db: Session, workflow: WorkflowDB) -> List[dict]:
+    rows = (
+        db.query(WorkflowVersionDB.version, WorkflowVersionDB.kind, WorkflowVersionDB.created_at)
+        .filter(WorkflowVersionDB.workflow_id == workflow.id)
+        .order_by(WorkflowVersionDB.version)
+        .all()
+    )
+    versions = [{"version": 1, "kind": "snapshot", "created_at": workflow.created_at.isoformat()}]
+    versions.extend(
+        {"version": row.version, "kind": row.kind, "created_at": row.created_at.isoformat() if row.created_at else None}
+        for row in rows
+    )
+    return versions
+
+def delete_workflow(db: Session, workflow: WorkflowDB):
+    db.query(WorkflowVersionDB).filter(WorkflowVersionDB.workflow_id == workflow.id).delete()
+    db.delete(workflow)
+    db.commit()
+    _forget(workflow.id)
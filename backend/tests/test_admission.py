@@ -0,0 +1,139 @@
+import asyncio
+
+from app.services import admission
+from app.services.admission import AdmissionController, AdmissionRejected
+
+
+def make_controller(**overrides):
+    settings = dict(key_rate_per_minute=6000, key_burst=100, workflow_rate_per_minute=6000,
+                    workflow_burst=100, max_concurrency=1, max_queue=4, max_wait=1)
+    settings.update(overrides)
+    return AdmissionController(**settings)
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def scenario():
+        controller = make_controller()
+        first = await controller.admit("key", "wf")
+        waiter = asyncio.ensure_future(controller.admit("key", "wf"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        await first.__aexit__(None, None, None)
+        await asyncio.sleep(0.01)
+        assert controller._active == 0
+        assert controller._waiters == []
+        async with await controller.admit("key", "wf"):
+            assert controller._active == 1
+
+    asyncio.run(scenario())
+
+
+def test_waiter_cancelled_after_hand_over_passes_slot_on():
+    async def scenario():
+        controller = make_controller()
+        await controller.admit("key", "wf")
+        waiter = asyncio.ensure_future(controller.admit("key", "wf"))
+        await asyncio.sleep(0.01)
+        controller._release()
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        assert controller._active == 0
+
+    asyncio.run(scenario())
+
+
+def test_rejected_after_reservation_does_not_use_quota():
+    async def scenario():
+        controller = make_controller(max_queue=1, max_wait=0.05)
+        first = await controller.admit("key", "wf")
+        waiter = asyncio.ensure_future(controller.admit("key", "wf"))
+        await asyncio.sleep(0.01)
+        # Queue is full: rejected before reserving anything
+        try:
+            await controller.admit("key", "wf")
+        except AdmissionRejected as e:
+            assert e.reason == "queue_full"
+        # The queued waiter times out and is refunded
+        try:
+            await waiter
+        except AdmissionRejected as e:
+            assert e.reason == "queue_timeout"
+        await first.__aexit__(None, None, None)
+        assert controller.stats("key")["quota"]["key_0"]["used_today"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_is_refunded():
+    async def scenario():
+        controller = make_controller()
+        await controller.admit("key", "wf")
+        waiter = asyncio.ensure_future(controller.admit("key", "wf"))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        assert controller.stats("key")["quota"]["key_0"]["used_today"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_longer_max_wait_paces_instead_of_rejecting():
+    async def scenario():
+        controller = make_controller(workflow_rate_per_minute=600, workflow_burst=1, max_wait=0.01)
+        async with await controller.admit("key", "wf"):
+            pass
+        try:
+            await controller.admit("key", "wf")
+        except AdmissionRejected as e:
+            assert e.reason == "rate_limited"
+        else:
+            raise AssertionError("interactive call should fail fast")
+        async with await controller.admit("key", "wf", max_wait=1):
+            pass
+
+    asyncio.run(scenario())
+
+
+def test_every_model_attempt_counts_against_the_daily_quota(monkeypatch):
+    import app.main as main
+
+    class FailingBackend:
+        name = "simulator"
+        calls = 0
+
+        def generate(self, model, payload, timeout=30):
+            FailingBackend.calls += 1
+            return 500, {}
+
+    controller = make_controller(daily_quota=6)
+    monkeypatch.setattr(main, "get_admission", lambda: controller)
+    service = main.AIService.__new__(main.AIService)
+    service.gemini_key, service.backend = "key", FailingBackend()
+
+    async def admitted_call():
+        async with await controller.admit("key", "wf"):
+            return service.generate_response("hello")
+
+    assert "All Gemini models failed" in asyncio.run(admitted_call())
+    assert controller.stats("key")["quota"]["key_0"]["used_today"] == 4
+
+    assert "daily quota" in asyncio.run(admitted_call())
+    assert FailingBackend.calls == 6
+    assert controller.stats("key")["quota"]["key_0"]["used_today"] == 6
+
+
+def test_idle_buckets_are_evicted(monkeypatch):
+    monkeypatch.setattr(admission, "BUCKET_SWEEP_INTERVAL", 0)
+
+    async def scenario():
+        controller = make_controller(workflow_rate_per_minute=60000, daily_quota=0)
+        for workflow_id in range(50):
+            async with await controller.admit("key", workflow_id):
+                pass
+        await asyncio.sleep(0.01)
+        async with await controller.admit("key", "last"):
+            pass
+        assert list(controller._workflow_buckets) == ["last"]
+
+    asyncio.run(scenario())
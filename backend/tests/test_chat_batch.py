@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+
+GETTERS = (main.init_database, main.get_knowledge_base, main.get_ai_service,
+           main.get_web_search, main.get_admission)
+WEB_WORKFLOW = [{"type": "llmEngine", "data": {"webSearch": True}}]
+
+
+@pytest.fixture
+def make_client(tmp_path, monkeypatch):
+    """TestClient against simulated upstreams and a throwaway database."""
+    monkeypatch.setenv("DATABASE_URL", f"sqlite:///{tmp_path / 'test.db'}")
+    for name, value in {"LLM_PROVIDER": "simulator", "SEARCH_PROVIDER": "simulator",
+                        "SIM_LLM_LATENCY": "fixed:1", "SIM_SEARCH_LATENCY": "fixed:1",
+                        "SIM_LLM_TOKENS_PER_SECOND": "1000000", "LLM_RATE_PER_MINUTE": "6000",
+                        "LLM_BURST": "100", "LLM_WORKFLOW_RATE_PER_MINUTE": "6000",
+                        "LLM_WORKFLOW_BURST": "100", "GEMINI_DAILY_QUOTA": "1000"}.items():
+        monkeypatch.setenv(name, value)
+    clients = []
+
+    def make(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        for getter in GETTERS:
+            getter.cache_clear()
+        client = TestClient(main.app)
+        client.__enter__()
+        clients.append(client)
+        return client
+
+    yield make
+    for client in clients:
+        client.__exit__(None, None, None)
+    for getter in GETTERS:
+        getter.cache_clear()
+
+
+def run_batch(client, messages, **options):
+    workflow_id = client.post("/workflows", json={"name": "batch", "components": WEB_WORKFLOW}).json()["workflow_id"]
+    response = client.post("/chat/batch", json={"workflow_id": str(workflow_id), "messages": messages, **options})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_full_admission_queue_paces_batch_items(make_client, monkeypatch):
+    monkeypatch.setattr(main, "BATCH_QUEUE_BACKOFF", 0.05)
+    client = make_client(LLM_MAX_CONCURRENCY="1", LLM_MAX_QUEUE="0", SIM_LLM_LATENCY="fixed:50")
+
+    lines = run_batch(client, [f"question {i} about rivers" for i in range(4)], concurrency=4)
+
+    assert lines[-1]["errors"] == 0
+    assert all("response" in line for line in lines[:-1])
+
+
+def test_batch_streams_one_line_per_item_and_a_summary(make_client):
+    messages = ["What is the longest river in Europe", "hi", "Which river flows through Vienna"]
+
+    lines = run_batch(make_client(), messages)
+
+    items, summary = lines[:-1], lines[-1]
+    assert sorted(line["index"] for line in items) == [0, 1, 2]
+    assert all(line["message"] == messages[line["index"]] and "response" in line for line in items)
+    assert summary == {"done": True, "workflow_used": "batch", "total": 3, "errors": 0, "web_searches": 2}
+
+
+def test_repeated_queries_share_one_web_search(make_client):
+    messages = ["Rivers of Europe", "rivers   of EUROPE", "Rivers of Europe", "Mountains of Asia"]
+
+    lines = run_batch(make_client(), messages)
+
+    assert lines[-1]["web_searches"] == 2
+    assert all(line["web_search_used"] for line in lines[:-1])
+
+
+def test_search_many_matches_search_for_each_query(tmp_path):
+    kb = main.KnowledgeBase()
+    texts = ["Python is a language. Python has classes.", "The python snake is long.",
+             "Rivers: the Danube flows through Vienna.", "PYTHON packaging guide", "python again here"]
+    for index, text in enumerate(texts):
+        path = tmp_path / f"doc{index}.txt"
+        path.write_text(text, encoding="utf-8")
+        assert kb.add_document(str(path), f"doc{index}", path.name)
+
+    queries = ["python", "Python ", "danube", "missing", "python", "THE"]
+    hits = kb.search_many(queries)
+
+    assert set(hits) == set(queries)
+    for query in queries:
+        assert hits[query] == kb.search(query), query
+
+
+def test_unknown_workflows_are_refused_before_admission(make_client):
+    client = make_client()
+    for workflow_id in ["12345", "not-a-number"]:
+        assert client.post("/chat", json={"message": "rivers", "workflow_id": workflow_id}).status_code == 404
+        assert client.post("/chat/batch", json={"messages": ["rivers"], "workflow_id": workflow_id}).status_code == 404
+    assert main.get_admission()._workflow_buckets == {}
+
+    workflow_id = client.post("/workflows", json={"name": "w", "components": WEB_WORKFLOW}).json()["workflow_id"]
+    assert client.post("/chat", json={"message": "rivers", "workflow_id": f" {workflow_id}"}).status_code == 200
+    assert list(main.get_admission()._workflow_buckets) == [str(workflow_id)]
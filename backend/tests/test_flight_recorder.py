@@ -0,0 +1,63 @@
+import asyncio
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from app.services.flight_recorder import FlightRecorder, FlightRecorderMiddleware, annotate, item, stage
+
+
+def make_app(recorder):
+    app = FastAPI()
+    app.add_middleware(FlightRecorderMiddleware, get_recorder=lambda: recorder,
+                       authorize_profile=lambda token: token == "secret")
+
+    @app.get("/fast")
+    async def fast():
+        return {}
+
+    @app.get("/stream")
+    async def stream():
+        annotate(total=2)
+
+        async def body():
+            for index in range(2):
+                with item(index):
+                    with stage("work"):
+                        await asyncio.sleep(0.05)
+                    annotate(index=index)
+                yield f"{index}\n"
+
+        return StreamingResponse(body())
+
+    return app
+
+
+def test_trace_covers_streamed_body_and_groups_items():
+    recorder = FlightRecorder(enabled=True, slow_ms=0)
+    with TestClient(make_app(recorder)) as client:
+        assert client.get("/stream").text == "0\n1\n"
+
+    record = recorder.slow_requests()[0]
+    assert record["status_code"] == 200
+    assert record["duration_ms"] >= 100
+    assert record["total"] == 2 and "index" not in record
+    assert record["stages"] == []
+    assert [record["items"][key]["index"] for key in ("0", "1")] == [0, 1]
+    assert record["items"]["1"]["stages"][0]["stage"] == "work"
+
+
+def test_forced_profiles_need_admin_token_and_keep_slow_requests():
+    recorder = FlightRecorder(enabled=True, capacity=2, slow_ms=80)
+    with TestClient(make_app(recorder)) as client:
+        client.get("/stream")
+        for _ in range(3):
+            client.get("/fast", headers={"X-Profile": "1"})
+        assert recorder.profiled_requests() == []
+        for _ in range(3):
+            client.get("/fast", headers={"X-Profile": "1", "X-Admin-Token": "secret"})
+
+    assert [record["path"] for record in recorder.slow_requests()] == ["/stream"]
+    profiles = recorder.profiled_requests()
+    assert len(profiles) == 2 and all("profile" in record for record in profiles)
+    assert recorder.get(profiles[0]["id"])["path"] == "/fast"
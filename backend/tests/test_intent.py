@@ -0,0 +1,55 @@
+import time
+
+from app.services.intent import classify_query
+
+
+def route(query):
+    classify_query.cache_clear()
+    return classify_query(query).route
+
+
+def test_small_talk_is_answered_directly():
+    for query in ["hi", "Hello there!", "thank you so much", "thanks, bye", "ok cool :)",
+                  "thank you thank you!", "how are you doing today?"]:
+        assert route(query) == "direct", query
+
+
+def test_questions_containing_greetings_are_not_small_talk():
+    assert route("which airlines fly to Ohio") == "web"
+    assert route("hi, what is the capital of France") == "web"
+
+
+def test_small_talk_near_miss_does_not_backtrack():
+    for query in ["thank you " * 30 + "x", "hi " * 40 + "?x", "ok! " * 40 + "and then"]:
+        started = time.perf_counter()
+        assert route(query) != "direct"
+        assert time.perf_counter() - started < 0.1, query
+
+
+def test_only_the_users_own_documents_route_to_the_knowledge_base():
+    for query in ["summarize my uploaded documents", "what does the attached pdf say",
+                  "search our files for the refund policy", "is this in the knowledge base"]:
+        assert route(query) == "kb", query
+    for query in ["how do I share files on Google Drive", "BBC documents leaked about the budget",
+                  "how to upload a document to google docs"]:
+        assert route(query) == "web", query
+
+
+def test_bare_numbers_are_looked_up_but_arithmetic_is_answered_directly():
+    assert route("2024") == "web"
+    assert route("2024?") == "web"
+    assert route("12 * (3 + 4)") == "direct"
+    assert route("2^10 =") == "direct"
+
+
+def test_dates_ranges_and_phone_numbers_are_not_arithmetic():
+    for query in ["2024-2025", "1/1/2024", "555-1234", "(555) 123-4567"]:
+        assert route(query) == "web", query
+    assert route("10 - 3") == "direct"
+
+
+def test_arithmetic_check_is_linear_on_long_digit_strings():
+    for query in ["1 " * 40000 + "+x", "9" * 80000 + "-", "1+" * 40000 + "a"]:
+        started = time.perf_counter()
+        assert route(query) != "direct"
+        assert time.perf_counter() - started < 0.5, len(query)
@@ -0,0 +1,24 @@
+import random
+
+import pytest
+
+from app.services.providers import LatencyModel, make_simulated_llm
+
+
+@pytest.mark.parametrize("spec", ["fixed", "uniform:100", "normal:1:2:3", "lognormal:0:0.5",
+                                  "exponential:-1", "gamma:1:2", "fixed:abc"])
+def test_bad_latency_specs_fail_at_construction(spec):
+    with pytest.raises(ValueError):
+        LatencyModel(spec)
+
+
+@pytest.mark.parametrize("spec", ["fixed:200", "uniform:100:500", "normal:300:50",
+                                  "lognormal:800:0.5", "exponential:400"])
+def test_latency_specs_sample_seconds(spec):
+    assert LatencyModel(spec).sample(random.Random(0)) >= 0
+
+
+def test_bad_simulator_setting_fails_at_startup(monkeypatch):
+    monkeypatch.setenv("SIM_LLM_LATENCY", "uniform:100")
+    with pytest.raises(ValueError):
+        make_simulated_llm()
@@ -0,0 +1,23 @@
+from fastapi.testclient import TestClient
+
+from app.services import simulator_server
+from app.services.providers import SimulatedGeminiBackend
+
+STREAM_URL = "/v1beta/models/gemini-2.0-flash:streamGenerateContent?alt=sse"
+PAYLOAD = {"contents": [{"parts": [{"text": "hello"}]}]}
+
+
+def test_stream_failure_is_an_http_error_not_a_broken_stream(monkeypatch):
+    monkeypatch.setattr(simulator_server, "llm", SimulatedGeminiBackend(latency="fixed:1", error_rate=1.0))
+    with TestClient(simulator_server.app) as client:
+        response = client.post(STREAM_URL, json=PAYLOAD)
+    assert response.status_code in (429, 500, 503)
+    assert response.json()["error"]["status"] == "SIMULATED"
+
+
+def test_stream_success_sends_events(monkeypatch):
+    monkeypatch.setattr(simulator_server, "llm", SimulatedGeminiBackend(latency="fixed:1", tokens_per_second=1e6))
+    with TestClient(simulator_server.app) as client:
+        response = client.post(STREAM_URL, json=PAYLOAD)
+    assert response.status_code == 200
+    assert response.text.count("data: ") == 4
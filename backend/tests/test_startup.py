@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parents[1]
+
+CHECK = """
+import json, sys
+import app.main as main
+getters = [main.init_database, main.get_knowledge_base, main.get_ai_service,
+           main.get_web_search, main.get_admission, main.get_flight_recorder]
+print(json.dumps({
+    "populated": [g.__name__ for g in getters if g.cache_info().currsize],
+    "sqlalchemy": any(name.startswith("sqlalchemy") for name in sys.modules),
+}))
+"""
+
+
+def test_import_creates_no_database_and_no_services(tmp_path):
+    env = {key: value for key, value in os.environ.items() if key != "DATABASE_URL"}
+    env["PYTHONPATH"] = str(BACKEND)
+    result = subprocess.run([sys.executable, "-c", CHECK], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60, check=True)
+
+    state = json.loads(result.stdout.strip().splitlines()[-1])
+    assert state == {"populated": [], "sqlalchemy": False}
+    assert not (tmp_path / "flowintellect.db").exists()
@@ -0,0 +1,119 @@
+import copy
+import json
+import random
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database_models import Base
+from app.services import workflow_versions
+from app.services.workflow_versions import apply_patch, make_patch
+
+GRAPH = {"nodes": [{"id": "1", "type": "llm", "data": {"model": "gemini"}}], "edges": []}
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    session = sessionmaker(bind=engine)()
+    workflow_versions._cache.clear()
+    yield session
+    session.close()
+    workflow_versions._cache.clear()
+
+
+def test_rename_without_components_keeps_the_graph(db):
+    workflow = workflow_versions.create_workflow(db, "old", GRAPH)
+
+    assert workflow_versions.save_version(db, workflow, name="new")
+
+    assert workflow.name == "new"
+    assert workflow.version == 1
+    assert workflow_versions.load_components(db, workflow) == GRAPH
+
+
+def random_value(rng, depth=0):
+    choice = rng.randrange(8 if depth < 3 else 5)
+    if choice == 0:
+        return rng.choice([True, False, None])
+    if choice == 1:
+        return rng.choice([0, 1, 2])
+    if choice == 2:
+        return rng.choice([0.0, 1.0, 2.5])
+    if choice in (3, 4):
+        return rng.choice(["", "a", "b/c", "~0"])
+    if choice in (5, 6):
+        return [random_value(rng, depth + 1) for _ in range(rng.randrange(5))]
+    return {rng.choice(["a", "b", "x/y", "m~n"]): random_value(rng, depth + 1) for _ in range(rng.randrange(4))}
+
+
+def mutate(rng, value):
+    value = copy.deepcopy(value)
+    if isinstance(value, list) and value and rng.random() < 0.7:
+        index = rng.randrange(len(value))
+        action = rng.randrange(3)
+        if action == 0:
+            del value[index]
+        elif action == 1:
+            value.insert(index, random_value(rng, 2))
+        else:
+            value[index] = mutate(rng, value[index])
+        return value
+    if isinstance(value, dict) and value and rng.random() < 0.7:
+        key = rng.choice(list(value))
+        value[key] = mutate(rng, value[key])
+        return value
+    return random_value(rng, 2)
+
+
+def test_patch_round_trip_is_type_strict():
+    assert make_patch([1, 2], [True, 2]) == [{"op": "replace", "path": "/0", "value": True}]
+    assert apply_patch({"n": [1, 1.0]}, make_patch({"n": [1, 1.0]}, {"n": [1.0, True]})) == {"n": [1.0, True]}
+
+    rng = random.Random(0)
+    for _ in range(500):
+        old = random_value(rng)
+        new = mutate(rng, old)
+        result = apply_patch(old, make_patch(old, new))
+        assert json.dumps(result, sort_keys=True) == json.dumps(new, sort_keys=True)
+
+
+def test_every_version_replays_across_snapshots(db):
+    rng = random.Random(1)
+    graph = {"nodes": [{"id": str(i), "data": {"value": i}} for i in range(5)], "edges": []}
+    workflow = workflow_versions.create_workflow(db, "w", graph)
+    history = [copy.deepcopy(graph)]
+    while workflow.version < 2 * workflow_versions.snapshot_every() + 3:
+        graph = copy.deepcopy(graph)
+        graph["nodes"][rng.randrange(len(graph["nodes"]))]["data"]["value"] = rng.choice([1, 1.0, True, "1"])
+        if rng.random() < 0.3:
+            graph["edges"].append({"source": "0", "target": str(len(graph["edges"]))})
+        if workflow_versions.save_version(db, workflow, graph):
+            history.append(copy.deepcopy(graph))
+
+    kinds = {row["kind"] for row in workflow_versions.list_versions(db, workflow)}
+    assert kinds == {"snapshot", "patch"}
+
+    # Newest first, so replaying later versions in place must not touch the stored bases
+    workflow_versions._cache.clear()
+    for version, expected in reversed(list(enumerate(history, 1))):
+        components = workflow_versions.load_components(db, workflow, version)
+        assert json.dumps(components, sort_keys=True) == json.dumps(expected, sort_keys=True)
+    workflow_versions._cache.clear()
+    for version, expected in enumerate(history, 1):
+        components = workflow_versions.load_components(db, workflow, version)
+        assert json.dumps(components, sort_keys=True) == json.dumps(expected, sort_keys=True)
+
+
+def test_snapshot_interval_is_read_when_saving(db, monkeypatch):
+    workflow = workflow_versions.create_workflow(db, "w", dict(GRAPH, n=0))
+    workflow_versions.save_version(db, workflow, dict(GRAPH, n=1))
+    monkeypatch.setenv("WORKFLOW_SNAPSHOT_EVERY", "3")
+    workflow_versions.save_version(db, workflow, dict(GRAPH, n=2))
+    assert [row["kind"] for row in workflow_versions.list_versions(db, workflow)] == ["snapshot", "patch", "snapshot"]
+
+    monkeypatch.setenv("WORKFLOW_SNAPSHOT_EVERY", "0")
+    with pytest.raises(ValueError):
+        workflow_versions.save_version(db, workflow, dict(GRAPH, n=3))
@@ -83,14 +83,15 @@ const App = () => {
   const saveWorkflow = async () => {
     if (!workflowValid) return alert('❌ Validate workflow first!');
     try {
-      const response = await axios.post('http://localhost:8000/workflows', {
-        name: `Workflow-${Date.now()}`,
-        components: nodes.map(node => ({ type: node.type, position: node.position, data: node.data }))
-      });
+      const components = nodes.map(node => ({ type: node.type, position: node.position, data: node.data }));
+      // Editing a saved workflow stores a new version (diff only) instead of a new workflow
+      const response = selectedWorkflowId
+        ? await axios.put(`http://localhost:8000/workflows/${selectedWorkflowId}`, { components })
+        : await axios.post('http://localhost:8000/workflows', { name: `Workflow-${Date.now()}`, components });
       if (response.data.workflow_id) {
         setSelectedWorkflowId(response.data.workflow_id.toString());
         await loadWorkflows();
-        alert(`✅ Workflow Saved! ID: ${response.data.workflow_id}`);
+        alert(`✅ Workflow Saved! ID: ${response.data.workflow_id} (v${response.data.version})`);
       }
     } catch (error) {
       console.error('Save error:', error);
@@ -119,8 +120,8 @@ const App = () => {
 
   const loadSelectedWorkflow = useCallback(async (workflowId) => {
     try {
-      const response = await axios.get('http://localhost:8000/workflows');
-      const workflow = response.data.workflows?.find(w => w.id.toString() === workflowId.toString());
+      const response = await axios.get(`http://localhost:8000/workflows/${workflowId}`);
+      const workflow = response.data;
       
       if (workflow?.components) {
         setNodes([]); setEdges([]);
@@ -241,7 +242,7 @@ const App = () => {
           <select value={selectedWorkflowId} onChange={(e) => handleWorkflowSelect(e.target.value)} className="workflow-select">
             <option value="">🎯 Create New Workflow</option>
             {workflows.map(workflow => (
-              <option key={workflow.id} value={workflow.id}>📁 {workflow.name} (ID: {workflow.id})</option>
+              <option key={workflow.id} value={workflow.id}>📁 {workflow.name} (ID: {workflow.id}, v{workflow.version})</option>
             ))}
           </select>
         </div>